@@ -1,28 +1,23 @@
 from __future__ import division
 
+import asyncio
 import cairocffi
+import hashlib
 import os
+import socket
+import struct
+import time
+from array import array
+from collections import namedtuple
 from libqtile import bar
+from libqtile.log_utils import logger
 from libqtile.widget import base
-from pathlib import Path
 
-BAT_NAME = ""
-
-#configure the name of the battery automatically
-config = Path('/sys/class/power_supply/BAT0')
-if config.is_dir():
-    BAT_NAME = "BAT0"
-
-config = Path('/sys/class/power_supply/BAT1')
-if config.is_dir():
-    BAT_NAME = "BAT1"
-
-config = Path('/sys/class/power_supply/BAT2')
-if config.is_dir():
-    BAT_NAME = "BAT2"
-
-#Navigate to /sys/class/power_supply to check what the name is of your battery
-#Type it in manually
+# By default every battery found in /sys/class/power_supply is combined into
+# one reading. To show a single battery only, navigate to
+# /sys/class/power_supply to check what the name is of your battery and
+# type it in manually
+BAT_NAME = None
 #BAT_NAME = "..."
 
 BAT_DIR = '/sys/class/power_supply'
@@ -31,6 +26,28 @@ CHARGING = 'Charging'
 DISCHARGING = 'Discharging'
 UNKNOWN = 'Unknown'
 
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+# eta is the smoothed time to empty (or to full when charging) in hours
+BatteryInfo = namedtuple(
+    'BatteryInfo', 'stat now full power eta', defaults=(None,)
+)
+
+# Number of (timestamp, energy) samples the ETA regression runs over
+ETA_SAMPLES = 16
+
+# Charge levels and state suffixes of the icons in a battery theme
+ICON_LEVELS = (
+    'empty', '10', '20', '30', '40', '50', '60', '70', '80', '90', 'full',
+)
+ICON_SUFFIXES = ('', '-charge', '-charged')
+# Index into ICON_SUFFIXES for each battery status
+ICON_STATES = {CHARGING: 1, CHARGED: 2}
+
+# Result of the last scan of BAT_DIR, see _discover_supplies
+_supplies = None
+
 BATTERY_INFO_FILES = {
     'energy_now_file': ['energy_now', 'charge_now'],
     'energy_full_file': ['energy_full', 'charge_full'],
@@ -39,19 +56,764 @@ BATTERY_INFO_FILES = {
 }
 
 
+class SysfsReader(object):
+    """Reads attribute files of one power supply through cached descriptors.
+
+    Every attribute is opened once and re-read with preadv into a shared
+    buffer, so a poll costs one syscall per attribute instead of
+    open/read/close. When the supply is unplugged the kernel fails reads with
+    ENODEV; the descriptor is then dropped and reopened on the next read.
+    """
+
+    def __init__(self, path, bufsize=64):
+        self.path = path
+        self._fds = {}
+        self._buf = bytearray(bufsize)
+
+    def _open(self, name):
+        fd = os.open(os.path.join(self.path, name), os.O_RDONLY)
+        self._fds[name] = fd
+        return fd
+
+    def drop(self, name):
+        fd = self._fds.pop(name, None)
+        if fd is not None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def read(self, name):
+        fd = self._fds.get(name)
+        if fd is None:
+            fd = self._open(name)
+        try:
+            size = os.preadv(fd, [self._buf], 0)
+        except OSError:
+            # The supply went away (and maybe came back with a new kobject),
+            # retry once with a fresh descriptor before giving up.
+            self.drop(name)
+            size = os.preadv(self._open(name), [self._buf], 0)
+        return self._buf[:size].decode().strip()
+
+    def close(self):
+        for name in list(self._fds):
+            self.drop(name)
+
+
+def _parse_uevent(data):
+    """Split a kernel uevent datagram into its header and environment"""
+    parts = data.split(b'\0')
+    header = parts[0].decode(errors='replace')
+    env = {}
+    for item in parts[1:]:
+        key, sep, value = item.partition(b'=')
+        if sep:
+            env[key.decode(errors='replace')] = value.decode(errors='replace')
+    return header, env
+
+
+class ReplayUeventSource(object):
+    """Stand-in for the netlink socket that replays recorded uevents.
+
+    The datagrams are queued on a unix socketpair, so the listener sees a
+    real readable descriptor on the event loop, exactly like with netlink.
+    """
+
+    def __init__(self, datagrams=()):
+        self._sock, self._peer = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_DGRAM
+        )
+        self._sock.setblocking(False)
+        for data in datagrams:
+            self.push(data)
+
+    def push(self, data):
+        self._peer.send(data)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def recv(self, bufsize):
+        return self._sock.recv(bufsize)
+
+    def close(self):
+        self._sock.close()
+        self._peer.close()
+
+
+class _UeventListener(object):
+    """Calls back with the environment of every power_supply uevent.
+
+    Reads a NETLINK_KOBJECT_UEVENT socket (or any object with fileno/recv,
+    see ReplayUeventSource) from the asyncio event loop, so nothing runs
+    between events.
+    """
+
+    def __init__(self, callback, source=None):
+        self.callback = callback
+        self.source = source
+        self._loop = None
+
+    def start(self):
+        if self.source is None:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+            )
+            try:
+                sock.bind((0, UEVENT_KERNEL_GROUP))
+            except OSError:
+                sock.close()
+                raise
+            sock.setblocking(False)
+            self.source = sock
+        self._loop = asyncio.get_event_loop()
+        self._loop.add_reader(self.source.fileno(), self._readable)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self.source.fileno())
+            self._loop = None
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+
+    def _readable(self):
+        while True:
+            try:
+                data = self.source.recv(8192)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                logger.exception("Failed to read power_supply uevent")
+                return
+            if not data:
+                return
+            _, env = _parse_uevent(data)
+            if env.get('SUBSYSTEM') == 'power_supply':
+                self.callback(env)
+
+
+def _discover_supplies():
+    """Map each supply type in BAT_DIR to the names of its system supplies.
+
+    The scan is cached until _invalidate_supplies is called on a hotplug
+    uevent, so polls never list the directory.
+    """
+    global _supplies
+    if _supplies is None:
+        supplies = {}
+        try:
+            names = sorted(os.listdir(BAT_DIR))
+        except OSError:
+            names = []
+        for name in names:
+            try:
+                with open(os.path.join(BAT_DIR, name, 'type'), 'r') as f:
+                    kind = f.read().strip()
+            except IOError:
+                continue
+            # Batteries of Bluetooth/HID mice and headsets are not the
+            # laptop's, they have scope Device
+            try:
+                with open(os.path.join(BAT_DIR, name, 'scope'), 'r') as f:
+                    if f.read().strip() == 'Device':
+                        continue
+            except IOError:
+                pass
+            supplies.setdefault(kind, []).append(name)
+        _supplies = supplies
+    return _supplies
+
+
+def _invalidate_supplies():
+    global _supplies
+    _supplies = None
+
+
+def _png_size(path):
+    """Read width and height from the IHDR chunk without decoding the PNG"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n':
+        raise IOError("%s is not a PNG file" % path)
+    return struct.unpack('>II', header[16:24])
+
+
+def default_cache_path():
+    cache = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'qtile')
+
+
+def _neighbour_icons(key):
+    """Icon keys a battery in state `key` is likely to show next"""
+    parts = key.split('-')
+    if len(parts) < 2 or parts[0] != 'battery' or parts[1] not in ICON_LEVELS:
+        return []
+    index = ICON_LEVELS.index(parts[1])
+    suffix = ''.join('-' + part for part in parts[2:])
+    keys = [
+        'battery-%s%s' % (level, suffix)
+        for level in ICON_LEVELS[max(index - 1, 0):index + 2]
+    ]
+    keys.extend('battery-%s%s' % (parts[1], s) for s in ICON_SUFFIXES)
+    return [k for k in keys if k != key]
+
+
+class _IconAtlas(object):
+    """Battery icons rendered at bar height into slots of one surface.
+
+    Icons are decoded lazily: a slot is only rendered the first time its
+    pattern is asked for, and the neighbouring charge levels are then
+    warmed one per event loop iteration. patterns[key] puts the slot of
+    that icon at the origin, so painting it is a plain 1:1 copy. Atlases
+    are shared by all widgets with the same key and the rendered slots are
+    written to the cache directory, so a restart reads the raw pixels back
+    instead of decoding and resampling the PNGs.
+    """
+
+    _instances = {}
+    MAGIC = b'QBA2'
+    HEADER = struct.Struct('<4sIIII')
+
+    def __init__(self, keys, paths, params, cache_file):
+        self.keys = keys
+        self.paths = dict(zip(keys, paths))
+        self.params = params
+        self.cache_file = cache_file
+        self.slot_width = params['slot_width']
+        self.height = params['height']
+        self.loaded = set()
+        self.broken = set()
+        self.patterns = {}
+        self.surface = None
+        self._flush_handle = None
+        self._warm_queue = []
+
+    @classmethod
+    def get(cls, theme_path, icons, height, scale, y_poss, padding):
+        """Return the atlas for these settings, or None if an icon is missing"""
+        keys = sorted(icons)
+        paths = [os.path.join(theme_path, icons[key]) for key in keys]
+        try:
+            sizes = [_png_size(path) for path in paths]
+            mtimes = [os.stat(path).st_mtime_ns for path in paths]
+        except IOError:
+            return None
+        key = (
+            theme_path, height, scale, y_poss, padding,
+            tuple((k, icons[k]) for k in keys), tuple(mtimes),
+        )
+        atlas = cls._instances.get(key)
+        if atlas is not None:
+            return atlas
+
+        slot_width = 0
+        for input_width, input_height in sizes:
+            width = input_width / (input_height / (height - 1))
+            if width > slot_width:
+                slot_width = int(width) + padding * 2
+
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        cache_file = os.path.join(
+            default_cache_path(), 'battery-atlas-%s.bin' % digest
+        )
+        params = dict(
+            height=height, scale=scale, y_poss=y_poss, padding=padding,
+            slot_width=max(slot_width, 1),
+        )
+        atlas = cls(keys, paths, params, cache_file)
+        if not atlas._load():
+            atlas.surface = cairocffi.ImageSurface(
+                cairocffi.FORMAT_ARGB32,
+                atlas.slot_width * len(keys),
+                height,
+            )
+        cls._instances[key] = atlas
+        return atlas
+
+    def pattern(self, key):
+        """Pattern painting the icon key, or None if it can't be decoded"""
+        pattern = self.patterns.get(key)
+        if pattern is None:
+            if key in self.broken:
+                return None
+            if key not in self.loaded:
+                if not self._render(key):
+                    return None
+                self._warm(_neighbour_icons(key))
+            pattern = cairocffi.SurfacePattern(self.surface)
+            matrix = cairocffi.Matrix()
+            matrix.translate(self.keys.index(key) * self.slot_width, 0)
+            pattern.set_matrix(matrix)
+            pattern.set_filter(cairocffi.FILTER_FAST)
+            self.patterns[key] = pattern
+        return pattern
+
+    def _render(self, key):
+        height = self.height
+        scale = self.params['scale']
+        padding = self.params['padding']
+
+        try:
+            img = cairocffi.ImageSurface.create_from_png(self.paths[key])
+        except cairocffi.Error:
+            logger.warning("Could not load battery icon %s" % self.paths[key])
+            self.broken.add(key)
+            return False
+        input_width = img.get_width()
+        input_height = img.get_height()
+
+        sp = input_height / (height - 1)
+
+        width = input_width / sp
+
+        imgpat = cairocffi.SurfacePattern(img)
+
+        scaler = cairocffi.Matrix()
+
+        scaler.scale(sp, sp)
+        scaler.scale(scale, scale)
+        factor = (1 - 1 / scale) / 2
+        scaler.translate(-width * factor, -width * factor)
+        scaler.translate(padding * -1, self.params['y_poss'])
+        imgpat.set_matrix(scaler)
+
+        imgpat.set_filter(cairocffi.FILTER_BEST)
+
+        ctx = cairocffi.Context(self.surface)
+        ctx.translate(self.keys.index(key) * self.slot_width, 0)
+        ctx.rectangle(0, 0, self.slot_width, height)
+        ctx.clip()
+        ctx.set_source(imgpat)
+        ctx.paint()
+        self.surface.flush()
+        self.loaded.add(key)
+        self._schedule_flush()
+        return True
+
+    def _warm(self, keys):
+        done = self.loaded | self.broken
+        keys = [k for k in keys if k in self.paths and k not in done]
+        if not keys:
+            return
+        start = not self._warm_queue
+        self._warm_queue.extend(keys)
+        if start:
+            asyncio.get_event_loop().call_soon(self._warm_next)
+
+    def _warm_next(self):
+        while self._warm_queue:
+            key = self._warm_queue.pop(0)
+            if key not in self.loaded and key not in self.broken:
+                self._render(key)
+                break
+        if self._warm_queue:
+            asyncio.get_event_loop().call_soon(self._warm_next)
+
+    def _schedule_flush(self):
+        # Batch the renders of one warm-up into a single cache write
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                5, self._save
+            )
+
+    def _load(self):
+        try:
+            with open(self.cache_file, 'rb') as f:
+                header = f.read(self.HEADER.size)
+                mask = f.read(len(self.keys))
+                data = bytearray(f.read())
+        except IOError:
+            return False
+        if len(header) != self.HEADER.size or len(mask) != len(self.keys):
+            return False
+        magic, width, height, stride, slot_width = self.HEADER.unpack(header)
+        if magic != self.MAGIC or slot_width != self.slot_width or \
+                height != self.height or len(data) != stride * height:
+            return False
+        self.surface = cairocffi.ImageSurface.create_for_data(
+            data, cairocffi.FORMAT_ARGB32, width, height, stride
+        )
+        self.loaded = set(k for k, m in zip(self.keys, mask) if m)
+        return True
+
+    def _save(self):
+        self._flush_handle = None
+        surface = self.surface
+        header = self.HEADER.pack(
+            self.MAGIC, surface.get_width(), surface.get_height(),
+            surface.get_stride(), self.slot_width,
+        )
+        mask = bytes(k in self.loaded for k in self.keys)
+        tmp = self.cache_file + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                f.write(mask)
+                f.write(bytes(surface.get_data()))
+            os.replace(tmp, self.cache_file)
+        except OSError:
+            logger.warning(
+                "Could not write battery icon cache %s" % self.cache_file
+            )
+
+
 def default_icon_path():
     # default icons are in libqtile/resources/battery-icons
     root = os.sep.join(os.path.abspath(__file__).split(os.sep)[:-2])
     return os.path.join(root, 'resources', 'battery-icons')
 
 
+class _BatteryFiles(object):
+    """Attribute files of a single battery, read in one batched pass"""
+
+    def __init__(self, battery_name, files):
+        self.files = files
+        self.filenames = {}
+        self._reader = SysfsReader(os.path.join(BAT_DIR, battery_name))
+
+    def close(self):
+        self._reader.close()
+
+    def _load_file(self, name):
+        try:
+            return self._reader.read(name)
+        except IOError:
+            self._reader.drop(name)
+            if name == 'current_now':
+                return 0
+            return False
+        except Exception:
+            logger.exception("Failed to get %s" % name)
+
+    def _get_param(self, name):
+        if name in self.filenames and self.filenames[name]:
+            return self._load_file(self.filenames[name])
+        elif name not in self.filenames:
+            # Don't have the file name cached, figure it out
+
+            # Don't modify the global list! Copy with [:]
+            file_list = BATTERY_INFO_FILES.get(name, [])[:]
+
+            if self.files.get(name):
+                # If a file is manually specified, check it first
+                file_list.insert(0, self.files[name])
+
+            # Iterate over the possibilities, and return the first valid value
+            for file in file_list:
+                value = self._load_file(file)
+                if value is not False and value is not None:
+                    self.filenames[name] = file
+                    return value
+
+        # If we made it this far, we don't have a valid file.
+        # Set it to None to avoid trying the next time, unless the battery
+        # itself is missing and may still be plugged in later.
+        if os.path.isdir(self._reader.path):
+            self.filenames[name] = None
+
+        return None
+
+    def read(self):
+        try:
+            return BatteryInfo(
+                stat=self._get_param('status_file'),
+                now=float(self._get_param('energy_now_file')),
+                full=float(self._get_param('energy_full_file')),
+                power=float(self._get_param('power_now_file')),
+            )
+        except (TypeError, ValueError):
+            return False
+
+
+def _combine(infos):
+    """Merge the readings of several batteries into one BatteryInfo"""
+    stats = [info.stat for info in infos]
+    if CHARGING in stats:
+        stat = CHARGING
+    elif DISCHARGING in stats:
+        stat = DISCHARGING
+    elif all(s == CHARGED for s in stats):
+        stat = CHARGED
+    else:
+        stat = stats[0]
+    return BatteryInfo(
+        stat=stat,
+        now=sum(info.now for info in infos),
+        full=sum(info.full for info in infos),
+        power=sum(info.power for info in infos),
+    )
+
+
+class _EtaEstimator(object):
+    """Least squares fit of energy over time for a smoothed ETA.
+
+    Samples live in fixed-size ring buffers, and the sums for the fit are
+    updated as samples enter and leave the window, so adding a sample is
+    O(1) whatever the window size. Timestamps are relative to the first
+    sample to keep the sums precise.
+    """
+
+    def __init__(self, size=ETA_SAMPLES):
+        self.size = size
+        self._t = array('d', bytes(8 * size))
+        self._e = array('d', bytes(8 * size))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._pos = 0
+        self._origin = None
+        self._st = self._se = self._stt = self._ste = 0.0
+
+    def add(self, timestamp, energy):
+        if self._origin is None:
+            self._origin = timestamp
+        t = timestamp - self._origin
+        if self.count == self.size:
+            old_t = self._t[self._pos]
+            old_e = self._e[self._pos]
+            self._st -= old_t
+            self._se -= old_e
+            self._stt -= old_t * old_t
+            self._ste -= old_t * old_e
+        else:
+            self.count += 1
+        self._t[self._pos] = t
+        self._e[self._pos] = energy
+        self._pos = (self._pos + 1) % self.size
+        self._st += t
+        self._se += energy
+        self._stt += t * t
+        self._ste += t * energy
+
+    def slope(self):
+        """Energy change per second, or None with too few samples"""
+        n = self.count
+        if n < 2:
+            return None
+        denominator = n * self._stt - self._st * self._st
+        if denominator <= 0:
+            return None
+        return (n * self._ste - self._st * self._se) / denominator
+
+    def eta(self, info):
+        """Hours until the battery in `info` is empty or full"""
+        slope = self.slope()
+        if slope is None:
+            return None
+        if info.stat == DISCHARGING and slope < 0:
+            return info.now / -slope / 3600
+        if info.stat == CHARGING and slope > 0:
+            return (info.full - info.now) / slope / 3600
+        return None
+
+
+class _BatterySampler(object):
+    """Process-wide sampler of one battery, or of all batteries combined.
+
+    All widgets showing the same battery subscribe to one sampler, which
+    reads sysfs once per interval (or per uevent) and hands the resulting
+    BatteryInfo to every subscriber. Widgets are only notified when the
+    snapshot actually changed.
+    """
+
+    _instances = {}
+
+    def __init__(self, battery_name, files):
+        self.battery_name = battery_name
+        self.files = dict(files)
+        self.info = False
+        self.subscribers = []
+        self._batteries = {}
+        self._listener = None
+        self._timer = None
+        self._raw = False
+        self._estimator = _EtaEstimator()
+
+    @classmethod
+    def get(cls, widget):
+        files = tuple(
+            (name, getattr(widget, name, None)) for name in BATTERY_INFO_FILES
+        )
+        key = (widget.battery_name, files)
+        sampler = cls._instances.get(key)
+        if sampler is None:
+            sampler = cls._instances[key] = cls(widget.battery_name, files)
+        return sampler
+
+    def subscribe(self, widget):
+        if widget in self.subscribers:
+            return
+        self.subscribers.append(widget)
+        if len(self.subscribers) == 1:
+            self._start(widget)
+        else:
+            self._reschedule()
+        widget._on_sample(self.info)
+
+    def unsubscribe(self, widget):
+        if widget not in self.subscribers:
+            return
+        self.subscribers.remove(widget)
+        if not self.subscribers:
+            self._stop()
+
+    def _start(self, widget):
+        if widget.uevents:
+            listener = _UeventListener(self._on_uevent, widget.uevent_source)
+            try:
+                listener.start()
+            except OSError:
+                logger.warning("No power_supply uevents, polling instead")
+            else:
+                self._listener = listener
+        self.refresh()
+        self._reschedule()
+
+    def _stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        for battery in self._batteries.values():
+            battery.close()
+        self._batteries = {}
+
+    def _delay(self):
+        """Seconds until the next poll, adapted to the battery state.
+
+        A battery that is full, on AC or missing only changes on a plug
+        event, so it is polled slowly. Otherwise the next poll is timed to
+        land just before the next percent change at the measured rate, and
+        the upper bound shrinks as the charge approaches low_percentage.
+        """
+        widgets = self.subscribers
+        if not widgets:
+            return None
+        shortest = min(w.min_update_delay for w in widgets)
+        if self._listener is not None:
+            longest = min(w.safety_delay for w in widgets)
+        else:
+            longest = min(w.max_update_delay for w in widgets)
+
+        info = self._raw
+        if info is False or info.stat not in (CHARGING, DISCHARGING) or \
+                not info.full:
+            return longest
+
+        rate = self._estimator.slope()
+        rate = abs(rate) if rate else info.power / 3600
+        if not rate:
+            return min(min(w.update_delay for w in widgets), longest)
+
+        percent = info.now / info.full
+        if info.stat == DISCHARGING:
+            low = max(getattr(w, 'low_percentage', 0) for w in widgets)
+            if low and percent < 2 * low:
+                longest = max(
+                    shortest, longest * max(percent - low, 0) / low
+                )
+
+        step = info.full / 100
+        if info.stat == DISCHARGING:
+            left = info.now % step
+        else:
+            left = step - info.now % step
+        if left < step * 0.05:
+            # Just crossed a percent, the next one is a whole step away
+            left += step
+        delay = 0.9 * left / rate
+        return min(max(delay, shortest), longest)
+
+    def _reschedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        delay = self._delay()
+        if delay is not None:
+            self._timer = asyncio.get_event_loop().call_later(
+                delay, self._tick
+            )
+
+    def _tick(self):
+        self._timer = None
+        self.refresh()
+        self._reschedule()
+
+    def _names(self):
+        if self.battery_name:
+            return [self.battery_name]
+        return _discover_supplies().get('Battery', [])
+
+    def _on_uevent(self, env):
+        name = env.get('POWER_SUPPLY_NAME')
+        if env.get('ACTION') in ('add', 'remove'):
+            _invalidate_supplies()
+            battery = self._batteries.pop(name, None)
+            if battery is not None:
+                battery.close()
+        # A change of the AC adapter also flips the battery status
+        if name in self._names() or \
+                name in _discover_supplies().get('Mains', []) or \
+                env.get('POWER_SUPPLY_TYPE') == 'Mains':
+            self.refresh()
+            # The pending poll was timed for the old state, e.g. the slow
+            # one of a full battery on AC; time the next one for the new
+            self._reschedule()
+
+    def refresh(self):
+        raw = self._sample()
+        if raw == self._raw:
+            return
+        if raw is False or self._raw is False or raw.stat != self._raw.stat:
+            self._estimator.reset()
+        self._raw = raw
+        if raw is False:
+            info = raw
+        else:
+            if raw.stat in (CHARGING, DISCHARGING):
+                self._estimator.add(time.monotonic(), raw.now)
+            info = raw._replace(eta=self._estimator.eta(raw))
+        if info == self.info:
+            return
+        self.info = info
+        for widget in list(self.subscribers):
+            widget._on_sample(info)
+
+    def _sample(self):
+        infos = []
+        for name in self._names():
+            battery = self._batteries.get(name)
+            if battery is None:
+                battery = self._batteries[name] = _BatteryFiles(
+                    name, self.files
+                )
+            info = battery.read()
+            if info is not False:
+                infos.append(info)
+        if not infos:
+            return False
+        if len(infos) == 1:
+            return infos[0]
+        return _combine(infos)
+
+
 class _Battery(base._TextBox):
     """Base battery class"""
 
-    filenames = {}
-
     defaults = [
-        ('battery_name', BAT_NAME, 'ACPI name of a battery, usually BAT0'),
+        (
+            'battery_name',
+            BAT_NAME,
+            'ACPI name of a battery, usually BAT0, or None to combine all'
+            ' batteries'
+        ),
         (
             'status_file',
             'status',
@@ -76,62 +838,82 @@ class _Battery(base._TextBox):
             'Name of file with the current'
             ' power draw in /sys/class/power_supply/battery_name'
         ),
-        ('update_delay', 60, 'The delay in seconds between updates'),
+        (
+            'update_delay',
+            60,
+            'The delay in seconds between updates while the drain rate is'
+            ' unknown'
+        ),
+        (
+            'min_update_delay',
+            5,
+            'The shortest delay in seconds between updates'
+        ),
+        (
+            'max_update_delay',
+            300,
+            'The longest delay in seconds between updates, used while the'
+            ' battery is full or on AC'
+        ),
+        (
+            'uevents',
+            True,
+            'Update on power_supply uevents instead of polling every'
+            ' update_delay seconds'
+        ),
+        (
+            'safety_delay',
+            600,
+            'The delay in seconds between fallback polls while uevents'
+            ' are received'
+        ),
+        (
+            'uevent_source',
+            None,
+            'Object with fileno() and recv() to read uevents from instead'
+            ' of netlink, e.g. a ReplayUeventSource'
+        ),
     ]
 
     def __init__(self, **config):
         base._TextBox.__init__(self, "BAT", bar.CALCULATED, **config)
         self.add_defaults(_Battery.defaults)
+        self._sampler = _BatterySampler.get(self)
+        self._info = False
+        self._laid_out_length = None
+        self.redraws = {'full': 0, 'partial': 0}
 
-    def _load_file(self, name):
-        try:
-            path = os.path.join(BAT_DIR, self.battery_name, name)
-            with open(path, 'r') as f:
-                return f.read().strip()
-        except IOError:
-            if name == 'current_now':
-                return 0
-            return False
-        except Exception:
-            self.log.exception("Failed to get %s" % name)
-
-    def _get_param(self, name):
-        if name in self.filenames and self.filenames[name]:
-            return self._load_file(self.filenames[name])
-        elif name not in self.filenames:
-            # Don't have the file name cached, figure it out
-
-            # Don't modify the global list! Copy with [:]
-            file_list = BATTERY_INFO_FILES.get(name, [])[:]
+    def timer_setup(self):
+        # The shared sampler does the polling and calls _on_sample
+        self._sampler.subscribe(self)
 
-            if getattr(self, name, None):
-                # If a file is manually specified, check it first
-                file_list.insert(0, getattr(self, name))
+    def finalize(self):
+        self._sampler.unsubscribe(self)
+        base._TextBox.finalize(self)
 
-            # Iterate over the possibilities, and return the first valid value
-            for file in file_list:
-                value = self._load_file(file)
-                if value is not False and value is not None:
-                    self.filenames[name] = file
-                    return value
+    def _on_sample(self, info):
+        self._info = info
+        if self.configured:
+            self.update()
 
-        # If we made it this far, we don't have a valid file.
-        # Set it to None to avoid trying the next time.
-        self.filenames[name] = None
+    def _get_info(self):
+        return self._info
 
-        return None
+    def _redraw(self):
+        """Redraw only this widget, unless its width changed"""
+        length = self.length
+        if self.length_type == bar.STATIC or length == self._laid_out_length:
+            self.redraws['partial'] += 1
+            self.draw()
+        else:
+            # The bar has to move the widgets behind this one
+            self._laid_out_length = length
+            self.redraws['full'] += 1
+            self.bar.draw()
 
-    def _get_info(self):
-        try:
-            info = {
-                'stat': self._get_param('status_file'),
-                'now': float(self._get_param('energy_now_file')),
-                'full': float(self._get_param('energy_full_file')),
-                'power': float(self._get_param('power_now_file')),
-            }
-        except TypeError:
-            return False
-        return info
+    def cmd_redraw_stats(self):
+        """Return how often the widget redrew itself vs the whole bar"""
+        return dict(self.redraws)
 
 
 class Battery(_Battery):
@@ -147,8 +929,9 @@ class Battery(_Battery):
          ),
         ('error_message', 'Error', 'Error message if something is wrong'),
         ('format',
-         '{char} {percent:2.0%} {hour:d}:{min:02d}',
-         'Display format'
+         '{char} {percent:2.0%} {eta_smoothed}',
+         'Display format, {hour} and {min} give the instantaneous time left'
+         ' and {eta_smoothed} the time left averaged over recent samples'
          ),
         ('hide_threshold', None, 'Hide the text when there is enough energy'),
         ('low_percentage',
@@ -162,17 +945,10 @@ class Battery(_Battery):
         _Battery.__init__(self, **config)
         self.add_defaults(Battery.defaults)
 
-    def timer_setup(self):
-        update_delay = self.update()
-        if update_delay is None and self.update_delay is not None:
-            self.timeout_add(self.update_delay, self.timer_setup)
-        elif update_delay:
-            self.timeout_add(update_delay, self.timer_setup)
-
     def _configure(self, qtile, bar):
         if self.configured:
             self.update()
-        _Battery._configure(self, qtile, bar)
+        base._TextBox._configure(self, qtile, bar)
 
     def _get_text(self):
         info = self._get_info()
@@ -184,16 +960,16 @@ class Battery(_Battery):
             # hide the text when it's higher than threshold, but still
             # display `full` when the battery is fully charged.
             if self.hide_threshold and \
-                    info['now'] / info['full'] * 100.0 >= \
+                    info.now / info.full * 100.0 >= \
                     self.hide_threshold and \
-                    info['stat'] != CHARGED:
+                    info.stat != CHARGED:
                 return ''
-            elif info['stat'] == DISCHARGING:
+            elif info.stat == DISCHARGING:
                 char = self.discharge_char
-                time = info['now'] / info['power']
-            elif info['stat'] == CHARGING:
+                time = info.now / info.power
+            elif info.stat == CHARGING:
                 char = self.charge_char
-                time = (info['full'] - info['now']) / info['power']
+                time = (info.full - info.now) / info.power
             else:
                 return 'Full'
         except ZeroDivisionError:
@@ -206,24 +982,33 @@ class Battery(_Battery):
         else:
             hour = -1
             min = -1
-        percent = info['now'] / info['full']
-        if info['stat'] == DISCHARGING and percent < self.low_percentage:
-            self.layout.colour = self.low_foreground
+        if info.eta is not None:
+            eta_smoothed = '%d:%02d' % (int(info.eta), int(info.eta * 60) % 60)
+        else:
+            eta_smoothed = '%d:%02d' % (hour, min) if hour >= 0 else '-:--'
+        percent = info.now / info.full
+        if info.stat == DISCHARGING and percent < self.low_percentage:
+            colour = self.low_foreground
         else:
-            self.layout.colour = self.foreground
+            colour = self.foreground
+        # Setting the colour parses it and rebuilds the layout attributes,
+        # so only do that when it changes
+        if self.layout.colour != colour:
+            self.layout.colour = colour
 
         return self.format.format(
             char=char,
             percent=percent,
             hour=hour,
-            min=min
+            min=min,
+            eta_smoothed=eta_smoothed
         )
 
     def update(self):
         ntext = self._get_text()
         if ntext != self.text:
             self.text = ntext
-            self.bar.draw()
+            self._redraw()
 
 
 class BatteryIcon(_Battery):
@@ -235,6 +1020,12 @@ class BatteryIcon(_Battery):
         ('custom_icons', {}, 'dict containing key->filename icon map'),
         ("scaleadd", 0, "Enable/Disable image scaling"),
         ("y_poss", 0, "Modify y possition"),
+        (
+            'hysteresis',
+            0.01,
+            'How far (0 < x < 1) the charge has to move past a level'
+            ' boundary before the icon changes'
+        ),
     ]
 
     def __init__(self, **config):
@@ -245,7 +1036,7 @@ class BatteryIcon(_Battery):
         if self.theme_path:
             self.length_type = bar.STATIC
             self.length = 0
-        self.surfaces = {}
+        self.atlas = None
         self.current_icon = 'battery-missing'
         self.icons = dict([(x, '{0}.png'.format(x)) for x in (
             'battery-missing',
@@ -275,94 +1066,82 @@ class BatteryIcon(_Battery):
         )])
         self.icons.update(self.custom_icons)
 
-    def timer_setup(self):
-        self.update()
-        self.timeout_add(self.update_delay, self.timer_setup)
+        # icon_table[state][level] -> icon key, falling back to the plain
+        # level icon for states the theme has no icon for
+        self.icon_table = tuple(
+            tuple(
+                'battery-%s%s' % (level, suffix)
+                if 'battery-%s%s' % (level, suffix) in self.icons
+                else 'battery-%s' % level
+                for level in ICON_LEVELS
+            )
+            for suffix in ICON_SUFFIXES
+        )
+        self.current_level = None
 
     def _configure(self, qtile, bar):
         base._TextBox._configure(self, qtile, bar)
         self.setup_images()
 
     def _get_icon_key(self):
-        key = 'battery'
         info = self._get_info()
-        if info is False or not info.get('full'):
-            key += '-missing'
-        else:
-            percent = info['now'] / info['full']
-            if percent < .1:
-                key += '-empty'
-            elif percent < .2:
-                key += '-10'
-            elif percent < .3:
-                key += '-20'
-            elif percent < .4:
-                key += '-30'
-            elif percent < .5:
-                key += '-40'
-            elif percent < .6:
-                key += '-50'
-            elif percent < .5:
-                key += '-60'
-            elif percent < .8:
-                key += '-70'
-            elif percent < .9:
-                key += '-80'
-            elif percent < 1:
-                key += '-90'
-            else:
-                key += '-full'
+        if info is False or not info.full:
+            self.current_level = None
+            return 'battery-missing'
 
-            if info['stat'] == CHARGING:
-                key += '-charge'
-            elif info['stat'] == CHARGED:
-                key += '-charged'
-        return key
+        percent = info.now / info.full
+        level = min(max(int(percent * 10), 0), len(ICON_LEVELS) - 1)
+        last = self.current_level
+        # Stay on the current level while the charge hovers around the
+        # boundary to one of its neighbours, a full battery always shows
+        if last is not None and abs(level - last) == 1 and percent < 1 and \
+                abs(percent - max(level, last) / 10) < self.hysteresis:
+            level = last
+        self.current_level = level
+        return self.icon_table[ICON_STATES.get(info.stat, 0)][level]
 
     def update(self):
         icon = self._get_icon_key()
         if icon != self.current_icon:
             self.current_icon = icon
-            self.draw()
+            self._redraw()
 
     def draw(self):
         if self.theme_path:
+            pattern = self.atlas.pattern(self.current_icon)
+            if pattern is None:
+                # Lay the bar out again for the new width
+                self._text_mode()
+                self.bar.draw()
+                return
             self.drawer.clear(self.background or self.bar.background)
-            self.drawer.ctx.set_source(self.surfaces[self.current_icon])
-            self.drawer.ctx.paint()
+            self.drawer.ctx.set_source(pattern)
+            self.drawer.ctx.rectangle(0, 0, self.length, self.bar.height)
+            self.drawer.ctx.fill()
             self.drawer.draw(offsetx=self.offset, width=self.length)
         else:
             self.text = self.current_icon[8:]
             base._TextBox.draw(self)
 
-    def setup_images(self):
-        for key, name in self.icons.items():
-            try:
-                path = os.path.join(self.theme_path, name)
-                img = cairocffi.ImageSurface.create_from_png(path)
-            except cairocffi.Error:
-                self.theme_path = None
-                self.qtile.log.warning('Battery Icon switching to text mode')
-                return
-            input_width = img.get_width()
-            input_height = img.get_height()
+    def _text_mode(self):
+        self.theme_path = None
+        self.atlas = None
+        # The icon width no longer applies, size to the text instead
+        self.length_type = bar.CALCULATED
+        self.text = self.current_icon[8:]
+        self.qtile.log.warning('Battery Icon switching to text mode')
 
-            sp = input_height / (self.bar.height - 1)
-
-            width = input_width / sp
-            if width > self.length:
-                self.length = int(width) + self.actual_padding * 2
-
-            imgpat = cairocffi.SurfacePattern(img)
-
-            scaler = cairocffi.Matrix()
-
-            scaler.scale(sp, sp)
-            scaler.scale(self.scale, self.scale)
-            factor = (1 - 1 / self.scale) / 2
-            scaler.translate(-width * factor, -width * factor)
-            scaler.translate(self.actual_padding * -1, self.y_poss)
-            imgpat.set_matrix(scaler)
-
-            imgpat.set_filter(cairocffi.FILTER_BEST)
-            self.surfaces[key] = imgpat
+    def setup_images(self):
+        atlas = _IconAtlas.get(
+            self.theme_path,
+            self.icons,
+            self.bar.height,
+            self.scale,
+            self.y_poss,
+            self.actual_padding,
+        )
+        if atlas is None:
+            self._text_mode()
+            return
+        self.length = atlas.slot_width
+        self.atlas = atlas
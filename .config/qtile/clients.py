@@ -0,0 +1,324 @@
+"""Helpers for the client_new hooks in config.py."""
+
+import re
+import time
+from libqtile.log_utils import logger
+
+
+# X properties fetched for every new client, see _fetch_batched
+_PROPERTY_ATOMS = (
+    'WM_CLASS', 'WM_WINDOW_ROLE', '_NET_WM_NAME', 'WM_NAME',
+    '_NET_WM_WINDOW_TYPE', 'WM_TRANSIENT_FOR',
+)
+
+
+def _empty_props():
+    return {
+        'wm_class': [],
+        'role': None,
+        'title': '',
+        'wm_type': None,
+        'transient_for': None,
+    }
+
+
+def _fetch_batched(client):
+    """Ask the X server for all properties at once, then collect replies.
+
+    This costs one round trip instead of one per property. It relies on
+    the x11 backend internals and raises AttributeError/ImportError
+    anywhere else, in which case window_props uses the client methods.
+    X errors, e.g. for a window that is already gone, give empty props.
+    """
+    import xcffib
+    import xcffib.xproto
+    from libqtile.backend.x11.xcbq import WindowTypes
+
+    conn = client.window.conn
+    wid = client.window.wid
+    core = conn.conn.core
+    cookies = [
+        core.GetProperty(
+            False, wid, conn.atoms[name], xcffib.xproto.Atom.Any, 0, 2 ** 16
+        )
+        for name in _PROPERTY_ATOMS
+    ]
+    try:
+        (wm_class, role, net_name, name, wm_type, transient) = [
+            cookie.reply() for cookie in cookies
+        ]
+    except xcffib.ProtocolException:
+        # e.g. BadWindow for a popup destroyed right after it was mapped
+        return _empty_props()
+
+    def text(reply, utf8=False):
+        if not reply.value_len:
+            return ''
+        return reply.value.to_utf8() if utf8 else reply.value.to_string()
+
+    types = wm_type.value.to_atoms() if wm_type.value_len else ()
+    if types:
+        type_name = conn.atoms.get_name(types[0])
+        type_name = WindowTypes.get(type_name, type_name)
+    else:
+        type_name = None
+    parents = transient.value.to_atoms() if transient.value_len else ()
+    return {
+        'wm_class': [c for c in text(wm_class).split('\0') if c],
+        'role': text(role) or None,
+        'title': text(net_name, utf8=True) or text(name),
+        'wm_type': type_name,
+        'transient_for': parents[0] if parents else None,
+    }
+
+
+def window_props(client, refresh=False):
+    """X properties the hooks look at, fetched once per client.
+
+    The result is cached on the client; pass refresh=True for clients
+    that set their properties late, like Spotify's WM_CLASS.
+    """
+    props = getattr(client, '_props', None)
+    if props is None or refresh:
+        try:
+            props = _fetch_batched(client)
+        except (AttributeError, ImportError, KeyError):
+            props = {
+                'wm_class': client.get_wm_class() or [],
+                'role': client.get_wm_role(),
+                'title': client.name,
+                'wm_type': client.get_wm_type(),
+                'transient_for': client.get_wm_transient_for(),
+            }
+        client._props = props
+    return props
+
+
+class ClientPipeline(object):
+    """Runs the client_new rules of config.py from a single hook.
+
+    The window properties are fetched once, in one batch, before the first
+    stage, then every registered stage runs in order. Each stage is timed;
+    stages slower than `slow` seconds are logged, and `timings` keeps
+    count, total and worst time per stage for diagnosing slow mapping.
+    """
+
+    def __init__(self, slow=0.01):
+        self.slow = slow
+        self.stages = []
+        self.timings = {}
+
+    def stage(self, func):
+        """Decorator adding func(client) as the next stage"""
+        self.stages.append((func.__name__, func))
+        return func
+
+    def _record(self, name, elapsed):
+        count, total, worst = self.timings.get(name, (0, 0.0, 0.0))
+        self.timings[name] = (count + 1, total + elapsed, max(worst, elapsed))
+        if elapsed > self.slow:
+            logger.warning(
+                "client_new stage %s took %.1f ms" % (name, elapsed * 1000)
+            )
+
+    def __call__(self, client):
+        start = time.perf_counter()
+        try:
+            window_props(client)
+        except Exception:
+            logger.exception("client_new failed to read window properties")
+        self._record('window_props', time.perf_counter() - start)
+        for name, func in self.stages:
+            start = time.perf_counter()
+            try:
+                func(client)
+            except Exception:
+                logger.exception("client_new stage %s failed" % name)
+            self._record(name, time.perf_counter() - start)
+
+    def report(self):
+        """One line per stage: calls, mean and worst time in ms"""
+        lines = []
+        for name, (count, total, worst) in self.timings.items():
+            lines.append("%s: %d calls, mean %.2f ms, worst %.2f ms" % (
+                name, count, total / count * 1000, worst * 1000
+            ))
+        return "\n".join(lines)
+
+
+def _simple_rule(match):
+    """The (property, value) of a Match testing one plain string, or None"""
+    rules = getattr(match, '_rules', None)
+    if not rules or len(rules) != 1:
+        return None
+    prop, value = next(iter(rules.items()))
+    if prop not in ('wm_class', 'role') or not isinstance(value, str):
+        return None
+    return prop, value
+
+
+class GroupMatcher(object):
+    """Finds the group a new client belongs to without trying every Match.
+
+    Matches on a plain wm_class or role string go into hash indexes; only
+    regex, title and combined matches are tried one by one. The groups
+    keep their order: when several groups match, the first one wins, as
+    with a loop over group.matches. config.py builds the matcher at load
+    time, so a config reload rebuilds it.
+    """
+
+    def __init__(self, groups):
+        self.by_class = {}
+        self.by_role = {}
+        self.fallback = []
+        for position, (name, matches) in enumerate(groups):
+            for match in matches:
+                rule = _simple_rule(match)
+                if rule is None:
+                    self.fallback.append((position, name, match))
+                    continue
+                prop, value = rule
+                index = self.by_class if prop == 'wm_class' else self.by_role
+                index.setdefault(value, (position, name))
+
+    def resolve(self, client, refresh=False):
+        """Name of the group for client, or None"""
+        props = window_props(client, refresh)
+        best = None
+        for wm_class in props['wm_class']:
+            hit = self.by_class.get(wm_class)
+            if hit is not None and (best is None or hit < best):
+                best = hit
+        if self.by_role:
+            hit = self.by_role.get(props['role'])
+            if hit is not None and (best is None or hit < best):
+                best = hit
+        for position, name, match in self.fallback:
+            if best is not None and position >= best[0]:
+                break
+            if match.compare(client):
+                return name
+        return best[1] if best is not None else None
+
+
+class FloatRules(object):
+    """Float rules compiled into sets and one regex per window property.
+
+    A window is then decided in one pass over its properties instead of a
+    Match.compare call per rule. Rules on a single property with a plain
+    string become set lookups, regexes on the same property are joined
+    into one alternation, and everything else (functions, several
+    properties) is kept as a Match. Use as floating_layout's only rule:
+    Match(func=float_rules).
+    """
+
+    PROPERTIES = ('wm_class', 'role', 'title', 'wm_type')
+
+    def __init__(self, rules, floating_types=(), transient=True):
+        self.transient = transient
+        self.strings = dict((prop, set()) for prop in self.PROPERTIES)
+        self.strings['wm_type'].update(floating_types)
+        patterns = dict((prop, []) for prop in self.PROPERTIES)
+        self.fallback = []
+        for match in rules:
+            match_rules = getattr(match, '_rules', None)
+            if not match_rules or len(match_rules) != 1:
+                self.fallback.append(match)
+                continue
+            prop, value = next(iter(match_rules.items()))
+            if prop not in self.PROPERTIES:
+                self.fallback.append(match)
+            elif isinstance(value, str):
+                self.strings[prop].add(value)
+            elif isinstance(value, re.Pattern) and value.flags == re.UNICODE:
+                patterns[prop].append('(?:%s)' % value.pattern)
+            else:
+                self.fallback.append(match)
+        self.regexes = dict(
+            (prop, re.compile('|'.join(found)))
+            for prop, found in patterns.items() if found
+        )
+
+    def _test(self, prop, value):
+        if value in self.strings[prop]:
+            return True
+        regex = self.regexes.get(prop)
+        return regex is not None and bool(regex.match(value))
+
+    def __call__(self, client):
+        props = window_props(client)
+        if self.transient and props['transient_for']:
+            return True
+        for wm_class in props['wm_class']:
+            if self._test('wm_class', wm_class):
+                return True
+        for prop in ('role', 'title', 'wm_type'):
+            if props[prop] and self._test(prop, props[prop]):
+                return True
+        return any(match.compare(client) for match in self.fallback)
+
+
+class GroupOccupancy(object):
+    """Which groups have windows, as a bitmask in qtile.groups order.
+
+    Kept up to date from the group_window_add and client_killed hooks, so
+    finding the nearest occupied group is a mask operation instead of a
+    walk over the groups and their window lists.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.position = {}
+        self.counts = {}
+        self.window_group = {}
+        self.mask = 0
+
+    def rebuild(self, groups):
+        """Recount from scratch, e.g. at startup or when groups change"""
+        self.names = [group.name for group in groups]
+        self.position = dict((name, i) for i, name in enumerate(self.names))
+        self.counts = {}
+        self.window_group = {}
+        self.mask = 0
+        for group in groups:
+            for window in group.windows:
+                self.add(group, window)
+
+    def _update_bit(self, name):
+        position = self.position.get(name)
+        if position is None:
+            return
+        if self.counts.get(name):
+            self.mask |= 1 << position
+        else:
+            self.mask &= ~(1 << position)
+
+    def add(self, group, window):
+        old = self.window_group.get(window.wid)
+        if old == group.name:
+            return
+        if old is not None:
+            self.counts[old] -= 1
+            self._update_bit(old)
+        self.window_group[window.wid] = group.name
+        self.counts[group.name] = self.counts.get(group.name, 0) + 1
+        self._update_bit(group.name)
+
+    def remove(self, window):
+        name = self.window_group.pop(window.wid, None)
+        if name is not None:
+            self.counts[name] -= 1
+            self._update_bit(name)
+        return name
+
+    def occupied(self, name):
+        return bool(self.counts.get(name))
+
+    def previous(self, name):
+        """Name of the closest occupied group before name, wrapping around
+        to the last group like qtile.groups[idx - 1::-1], or None"""
+        position = self.position.get(name, 0)
+        below = self.mask & ((1 << position) - 1) if position else self.mask
+        if not below:
+            return None
+        return self.names[below.bit_length() - 1]
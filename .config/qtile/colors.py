@@ -1,122 +1,188 @@
 # If using transparency, make sure you add (background="#00000000") to 'Screen' line(s).
 # Then, you can use RGBA color codes to add transparency to the colors below.
-# For ex: colors = [["#282c34ee", "#282c34dd"], ...
-
-DoomOne = [
-    ["#282c34", "#282c34"], # bg
-    ["#bbc2cf", "#bbc2cf"], # fg
-    ["#1c1f24", "#1c1f24"], # color01
-    ["#ff6c6b", "#ff6c6b"], # color02
-    ["#98be65", "#98be65"], # color03
-    ["#da8548", "#da8548"], # color04
-    ["#51afef", "#51afef"], # color05
-    ["#c678dd", "#c678dd"], # color06
-    ["#46d9ff", "#46d9ff"]  # color15
-    ]
-
-Dracula  = [
-    ["#282a36", "#282a36"], # bg
-    ["#f8f8f2", "#f8f8f2"], # fg
-    ["#000000", "#000000"], # color01
-    ["#ff5555", "#ff5555"], # color02
-    ["#50fa7b", "#50fa7b"], # color03
-    ["#f1fa8c", "#f1fa8c"], # color04
-    ["#bd93f9", "#bd93f9"], # color05
-    ["#ff79c6", "#ff79c6"], # color06
-    ["#9aedfe", "#9aedfe"]  # color15
-    ]
-
-GruvboxDark  = [
-    ["#282828", "#282828"], # bg
-    ["#ebdbb2", "#ebdbb2"], # fg
-    ["#000000", "#000000"], # color01
-    ["#fb4934", "#fb4934"], # color02
-    ["#98971a", "#98971a"], # color03
-    ["#d79921", "#d79921"], # color04
-    ["#83a598", "#83a598"], # color05
-    ["#d3869b", "#d3869b"], # color06
-    ["#b8bb26", "#b8bb26"], # color11
-    ]
-MonokaiPro = [
-    ["#2D2A2E", "#2D2A2E"], # bg
-    ["#FCFCFA", "#FCFCFA"], # fg
-    ["#403E41", "#403E41"], # color01
-    ["#FF6188", "#FF6188"], # color02
-    ["#A9DC76", "#A9DC76"], # color03
-    ["#FFD866", "#FFD866"], # color04
-    ["#FC9867", "#FC9867"], # color05
-    ["#AB9DF2", "#AB9DF2"], # color06
-    ["#78DCE8", "#78DCE8"]  # color07
-    ]
-
-Nord = [
-    ["#2E3440", "#2E3440"], # bg
-    ["#D8DEE9", "#D8DEE9"], # fg
-    ["#3B4252", "#3B4252"], # color01
-    ["#BF616A", "#BF616A"], # color02
-    ["#A3BE8C", "#A3BE8C"], # color03
-    ["#EBCB8B", "#EBCB8B"], # color04
-    ["#81A1C1", "#81A1C1"], # color05
-    ["#B48EAD", "#B48EAD"], # color06
-    ["#88C0D0", "#88C0D0"]  # color07
-    ]
-
-OceanicNext = [
-    ["#1b2b34", "#1b2b34"], # bg
-    ["#d8dee9", "#d8dee9"], # fg
-    ["#29414f", "#29414f"], # color01
-    ["#ec5f67", "#ec5f67"], # color02
-    ["#99c794", "#99c794"], # color03
-    ["#fac863", "#fac863"], # color04
-    ["#6699cc", "#6699cc"], # color05
-    ["#c594c5", "#c594c5"], # color06
-    ["#5fb3b3", "#5fb3b3"]  # color07
-    ]
-
-Palenight = [
-    ["#292d3e", "#292d3e"], # bg
-    ["#d0d0d0", "#d0d0d0"], # fg
-    ["#434758", "#434758"], # color01
-    ["#f07178", "#f07178"], # color02
-    ["#c3e88d", "#c3e88d"], # color03
-    ["#ffcb6b", "#ffcb6b"], # color04
-    ["#82aaff", "#82aaff"], # color05
-    ["#c792ea", "#c792ea"], # color06
-    ["#89ddff", "#89ddff"]  # color15
-    ]
-
-SolarizedDark = [
-    ["#002b36", "#002b36"], # bg
-    ["#839496", "#839496"], # fg
-    ["#073642", "#073642"], # color01
-    ["#dc322f", "#dc322f"], # color02
-    ["#859900", "#859900"], # color03
-    ["#b58900", "#b58900"], # color04
-    ["#268bd2", "#268bd2"], # color05
-    ["#d33682", "#d33682"], # color06
-    ["#2aa198", "#2aa198"]  # color15
-    ]
-
-SolarizedLight = [
-    ["#fdf6e3", "#fdf6e3"], # bg
-    ["#657b83", "#657b83"], # fg
-    ["#ece5ac", "#ece5ac"], # color01
-    ["#dc322f", "#dc322f"], # color02
-    ["#859900", "#859900"], # color03
-    ["#b58900", "#b58900"], # color04
-    ["#268bd2", "#268bd2"], # color05
-    ["#d33682", "#d33682"], # color06
-    ["#2aa198", "#2aa198"]  # color15
-    ]
-
-TomorrowNight = [
-    ["#1d1f21", "#1d1f21"], # bg
-    ["#c5c8c6", "#c5c8c6"], # fg
-    ["#373b41", "#373b41"], # color01
-    ["#cc6666", "#cc6666"], # color02
-    ["#b5bd68", "#b5bd68"], # color03
-    ["#e6c547", "#e6c547"], # color04
-    ["#81a2be", "#81a2be"], # color05
-    ["#b294bb", "#b294bb"], # color06
-    ["#70c0ba", "#70c0ba"]  # color15
-    ]
+# For ex: DoomOne = Palette('DoomOne', ["#282c34ee", ...
+
+# Each colorscheme is parsed once, when this file is imported. palette[i]
+# is a plain "#rrggbb" string, which qtile draws as a solid colour; the
+# old ["#rrggbb", "#rrggbb"] pairs were drawn as a two stop gradient of
+# the same colour, building a new cairo gradient on every redraw.
+
+
+def _parse(colour):
+    """(r, g, b, a) floats of "#rrggbb" or "#rrggbbaa" """
+    digits = colour.lstrip('#')
+    if len(digits) == 6:
+        digits += 'ff'
+    if len(digits) != 8:
+        raise ValueError("not a colour: %r" % colour)
+    return tuple(int(digits[i:i + 2], 16) / 255 for i in range(0, 8, 2))
+
+
+def _hex(rgba):
+    r, g, b, a = (round(c * 255) for c in rgba)
+    if a == 255:
+        return '#%02x%02x%02x' % (r, g, b)
+    return '#%02x%02x%02x%02x' % (r, g, b, a)
+
+
+def _mix(rgba, other, amount):
+    mixed = (c + (o - c) * amount for c, o in zip(rgba[:3], other[:3]))
+    return tuple(mixed) + (rgba[3],)
+
+
+class Palette(object):
+    """A colorscheme with its colours parsed and shaded up front.
+
+    Index it like the old lists: palette[0] is the background, palette[1]
+    the foreground, then color01 onwards, all as hex strings. Beside them:
+
+    rgba         float (r, g, b, a) tuples for drawing with cairo directly
+    dim          each colour mixed halfway towards the background
+    bright       each colour mixed a quarter of the way towards white
+    translucent  each colour at 80% opacity, "#rrggbbcc"
+    """
+
+    __slots__ = ('name', 'hex', 'rgba', 'dim', 'bright', 'translucent')
+
+    def __init__(self, name, colours):
+        self.name = name
+        self.rgba = tuple(_parse(colour) for colour in colours)
+        self.hex = tuple(_hex(rgba) for rgba in self.rgba)
+        background = self.rgba[0]
+        self.dim = tuple(_hex(_mix(c, background, 0.5)) for c in self.rgba)
+        self.bright = tuple(
+            _hex(_mix(c, (1, 1, 1), 0.25)) for c in self.rgba
+        )
+        self.translucent = tuple(_hex(c[:3] + (0.8,)) for c in self.rgba)
+
+    def __getitem__(self, index):
+        return self.hex[index]
+
+    def __len__(self):
+        return len(self.hex)
+
+    def __iter__(self):
+        return iter(self.hex)
+
+    def __repr__(self):
+        return 'Palette(%r)' % self.name
+
+
+DoomOne = Palette('DoomOne', [
+    "#282c34", # bg
+    "#bbc2cf", # fg
+    "#1c1f24", # color01
+    "#ff6c6b", # color02
+    "#98be65", # color03
+    "#da8548", # color04
+    "#51afef", # color05
+    "#c678dd", # color06
+    "#46d9ff"  # color15
+    ])
+
+Dracula  = Palette('Dracula', [
+    "#282a36", # bg
+    "#f8f8f2", # fg
+    "#000000", # color01
+    "#ff5555", # color02
+    "#50fa7b", # color03
+    "#f1fa8c", # color04
+    "#bd93f9", # color05
+    "#ff79c6", # color06
+    "#9aedfe"  # color15
+    ])
+
+GruvboxDark  = Palette('GruvboxDark', [
+    "#282828", # bg
+    "#ebdbb2", # fg
+    "#000000", # color01
+    "#fb4934", # color02
+    "#98971a", # color03
+    "#d79921", # color04
+    "#83a598", # color05
+    "#d3869b", # color06
+    "#b8bb26", # color11
+    ])
+MonokaiPro = Palette('MonokaiPro', [
+    "#2D2A2E", # bg
+    "#FCFCFA", # fg
+    "#403E41", # color01
+    "#FF6188", # color02
+    "#A9DC76", # color03
+    "#FFD866", # color04
+    "#FC9867", # color05
+    "#AB9DF2", # color06
+    "#78DCE8"  # color07
+    ])
+
+Nord = Palette('Nord', [
+    "#2E3440", # bg
+    "#D8DEE9", # fg
+    "#3B4252", # color01
+    "#BF616A", # color02
+    "#A3BE8C", # color03
+    "#EBCB8B", # color04
+    "#81A1C1", # color05
+    "#B48EAD", # color06
+    "#88C0D0"  # color07
+    ])
+
+OceanicNext = Palette('OceanicNext', [
+    "#1b2b34", # bg
+    "#d8dee9", # fg
+    "#29414f", # color01
+    "#ec5f67", # color02
+    "#99c794", # color03
+    "#fac863", # color04
+    "#6699cc", # color05
+    "#c594c5", # color06
+    "#5fb3b3"  # color07
+    ])
+
+Palenight = Palette('Palenight', [
+    "#292d3e", # bg
+    "#d0d0d0", # fg
+    "#434758", # color01
+    "#f07178", # color02
+    "#c3e88d", # color03
+    "#ffcb6b", # color04
+    "#82aaff", # color05
+    "#c792ea", # color06
+    "#89ddff"  # color15
+    ])
+
+SolarizedDark = Palette('SolarizedDark', [
+    "#002b36", # bg
+    "#839496", # fg
+    "#073642", # color01
+    "#dc322f", # color02
+    "#859900", # color03
+    "#b58900", # color04
+    "#268bd2", # color05
+    "#d33682", # color06
+    "#2aa198"  # color15
+    ])
+
+SolarizedLight = Palette('SolarizedLight', [
+    "#fdf6e3", # bg
+    "#657b83", # fg
+    "#ece5ac", # color01
+    "#dc322f", # color02
+    "#859900", # color03
+    "#b58900", # color04
+    "#268bd2", # color05
+    "#d33682", # color06
+    "#2aa198"  # color15
+    ])
+
+TomorrowNight = Palette('TomorrowNight', [
+    "#1d1f21", # bg
+    "#c5c8c6", # fg
+    "#373b41", # color01
+    "#cc6666", # color02
+    "#b5bd68", # color03
+    "#e6c547", # color04
+    "#81a2be", # color05
+    "#b294bb", # color06
+    "#70c0ba"  # color15
+    ])
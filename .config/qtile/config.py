@@ -31,6 +31,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import functools
 import os
 import subprocess
 from libqtile import bar, extension, hook, layout, qtile, widget
@@ -42,8 +43,11 @@ from qtile_extras.widget.decorations import BorderDecoration
 #from qtile_extras.widget import StatusNotifier
 import colors
 import arcobattery
+import clients
+from screens import LazyScreens, build_widgets, spec, wants
+import statusbar
+import theme
 from datetime import datetime as dt
-import time
 
 
 # Allows you to input a name when adding treetab section.
@@ -53,43 +57,91 @@ def add_treetab_section(layout):
     prompt.start_input("Section name: ", layout.cmd_add_section)
 
 
-# When application launched automatically focus it's group
+# Spotify and a few others only set WM_CLASS after their window is mapped.
+# Rather than stalling every new window, look at those again a bit later.
+MATCH_RETRY_DELAY = 0.04
+MATCH_RETRIES = 5
+
+# All client_new rules run from this one hook, in the order they are
+# registered with @client_pipeline.stage. client_pipeline.report() shows
+# how long each of them takes.
+client_pipeline = clients.ClientPipeline()
+
 @hook.subscribe.client_new
-def modify_window(client):
-    for group in groups:  # follow on auto-move
-        match = next((m for m in group.matches if m.compare(client)), None)
-        if match:
-            targetgroup = client.qtile.groups_map[group.name]  # there can be multiple instances of a group
-            targetgroup.cmd_toscreen(toggle=False)
-            break
+def client_new(client):
+    client_pipeline(client)
+
+# When application launched automatically focus it's group
+@client_pipeline.stage
+def modify_window(client, attempt=0):
+    if attempt and client.wid not in client.qtile.windows_map:
+        return  # closed before it got a class
+    name = group_matcher.resolve(client, refresh=attempt > 0)  # follow on auto-move
+    if name:
+        if attempt:
+            # Too late for qtile's own matching, move it ourselves
+            client.togroup(name)
+        targetgroup = client.qtile.groups_map[name]  # there can be multiple instances of a group
+        targetgroup.cmd_toscreen(toggle=False)
+        return
+    if not clients.window_props(client)["wm_class"] and attempt < MATCH_RETRIES:
+        client.qtile.call_later(MATCH_RETRY_DELAY, modify_window, client, attempt + 1)
+
+# Tracks which groups have windows for fallback
+occupancy = clients.GroupOccupancy()
+
+@hook.subscribe.startup_complete
+def track_groups(*args):
+    occupancy.rebuild(qtile.groups)
+
+# Measures restart latency for comparison with colors.swap, see theme.py
+@hook.subscribe.shutdown
+def theme_restarting():
+    colors.restarting()
+
+@hook.subscribe.startup_complete
+def theme_started():
+    colors.started()
+
+hook.subscribe.addgroup(track_groups)
+hook.subscribe.delgroup(track_groups)
+
+@hook.subscribe.group_window_add
+def track_window(group, window):
+    occupancy.add(group, window)
 
 # Hook to fallback to the first group with windows when last window of group is killed
 @hook.subscribe.client_killed
 def fallback(window):
-    if window.group.windows != [window]:
+    if not occupancy.names:
+        # After a config reload no startup_complete fires, count now
+        occupancy.rebuild(qtile.groups)
+    occupancy.remove(window)
+    if window.group is None or occupancy.occupied(window.group.name):
+        return
+    previous = occupancy.previous(window.group.name)
+    if previous is not None:
+        qtile.current_screen.toggle_group(qtile.groups_map[previous])
         return
-    idx = qtile.groups.index(window.group)
-    for group in qtile.groups[idx - 1::-1]:
-        if group.windows:
-            qtile.current_screen.toggle_group(group)
-            return
     qtile.current_screen.toggle_group(qtile.groups[0])
 
-# Work around for matching Spotify
-@hook.subscribe.client_new
-def slight_delay(window):
-    time.sleep(0.04)
-
 
 # Add th, nd or st to the date - use custom_date in text box
 def suffix(d):
     return 'th' if 11 <= d <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(d % 10, 'th')
 
+# The day only changes once a day, keep the last rendered one
+@functools.lru_cache(maxsize=1)
+def day_with_suffix(d):
+    return str(d) + suffix(d)
+
 def custom_strftime(format, t):
-    return t.strftime(format).replace('{S}', str(t.day) + suffix(t.day))
+    return t.strftime(format).replace('{S}', day_with_suffix(t.day))
+
+CUSTOM_DATE_FORMAT = '%A {S} %B %Y - %H:%M'
 
 def custom_date():
-    return custom_strftime('%A {S} %B %Y - %H:%M', dt.now())
+    return custom_strftime(CUSTOM_DATE_FORMAT, dt.now())
 
 
 #mod4 or mod = super key
@@ -113,6 +165,10 @@ def window_to_next_group(qtile):
         i = qtile.groups.index(qtile.currentGroup)
         qtile.currentWindow.togroup(qtile.groups[i + 1].name)
 
+# colors is only a theme.Theme further down, look it up when called
+def next_colorscheme(qtile):
+    colors.cycle(qtile)
+
 keys = [
     # The essentials
     Key([mod], "Return", lazy.spawn(myTerm), desc="Terminal"),
@@ -134,6 +190,7 @@ keys = [
 
     Key([mod, "shift"], "q", lazy.window.kill()),
     Key([mod, "shift"], "r", lazy.restart()),
+    Key([mod, "shift"], "c", lazy.function(next_colorscheme), desc="Next colorscheme"),
 
 
 # QTILE LAYOUT KEYS
@@ -375,6 +432,9 @@ for i in range(len(group_names)):
             label=group_labels[i],
         ))
 
+# Indexes the groups' matches for modify_window
+group_matcher = clients.GroupMatcher((g.name, g.matches) for g in groups)
+
 for i in groups:
     keys.extend([
 
@@ -409,8 +469,14 @@ for i in groups:
 #
 # It is best not manually change the colorscheme; instead run 'dtos-colorscheme'
 # which is set to 'MOD + p c'
+#
+# Each colorscheme is a colors.Palette: colors[i] is a "#rrggbb" string,
+# colors.rgba[i] the parsed floats, and colors.dim, colors.bright and
+# colors.translucent hold shades of each colour.
 
 colors = colors.DoomOne
+# Wrapped so 'MOD + shift + c' can change it without restarting qtile
+colors = theme.Theme(colors)
 
 ### LAYOUTS ###
 # Some settings that I use on almost every layout, which saves us
@@ -470,28 +536,69 @@ widget_defaults = dict(
 )
 
 extension_defaults = widget_defaults.copy()
+colors.track(widget_defaults, extension_defaults)
+
+
+# The volume is read in-process when pulsectl or pyalsaaudio is installed,
+# otherwise fall back to polling the volumecontrol script.
+def volume_widget(**config):
+    if statusbar.volume_backend() is not None:
+        return statusbar.shared(statusbar.Volume)(**config)
+    return statusbar.AsyncPollText(
+        update_interval=1,
+        cmd=[os.path.expanduser("~/.local/bin/statusbar/volumecontrol")],
+        **config
+    )
+
+
+# The volumecontrol fallback is the only widget left running a script
+volume_tags = () if statusbar.volume_backend() is not None else ('poller',)
 
+# The line under the stats, left out on screens without 'decorated'
+def underline(colour):
+    if not wants('decorated'):
+        return []
+    return [BorderDecoration(colour=colour, border_width=[0, 0, 2, 0])]
 
-def init_widgets_list():
-    widgets_list = [
-        widget.Sep(padding=3, linewidth=0, background="#2f343f"),
-        widget.Image(
+
+# Every screen builds its own widgets from this list. Widgets wrapped in
+# statusbar.shared() take one sample per interval for all screens, and the
+# AsyncPollText copies share their command runs.
+#
+# Each screen has a profile, a set of tags. Entries can carry tags saying
+# what they need from a screen; a screen only builds the widgets whose
+# tags are all in its profile, the rest are never constructed for it:
+#   tray       the systray, which will crash if you try to run multiple
+#              instances of it
+#   poller     a widget running a ~/.local/bin/statusbar script
+# and underline() only decorates the stats on screens with:
+#   decorated  the BorderDecoration under the stats
+screen_profiles = {
+    'primary': {'tray', 'poller', 'decorated'},
+    'secondary': set(),
+}
+# Profile of each monitor, monitor 1 first
+screen_layout = ['primary', 'secondary', 'secondary']
+
+widget_specs = [
+        spec(lambda: widget.Sep(padding=3, linewidth=0, background="#2f343f")),
+        spec(lambda: widget.Image(
             filename='~/.config/qtile/eos-c.png',
             margin=3,
             background="#2f343f",
             mouse_callbacks={'Button1': lambda: qtile.cmd_spawn("rofi -show combi")}
-        ),
+        )),
         # widget.Image(
         #     filename = "~/.config/qtile/icons/logo.png",
         #     scale = "False",
         #     mouse_callbacks = {'Button1': lambda: qtile.cmd_spawn(myTerm)},
         # ),
-        widget.Prompt(
+        spec(lambda: widget.Prompt(
             font = "Ubuntu Mono",
             fontsize=14,
             foreground = colors[1]
-        ),
-        widget.GroupBox(
+        )),
+        spec(lambda: widget.GroupBox(
             fontsize = 11,
             margin_y = 3,
             margin_x = 4,
@@ -507,83 +614,68 @@ def init_widgets_list():
             this_screen_border = colors [4],
             other_current_screen_border = colors[7],
             other_screen_border = colors[4],
-        ),
-        widget.TextBox(
+        )),
+        spec(lambda: widget.TextBox(
             text = '|',
             font = "Ubuntu Mono",
             foreground = colors[1],
             padding = 2,
             fontsize = 14
-        ),
-        widget.CurrentLayoutIcon(
+        )),
+        spec(lambda: widget.CurrentLayoutIcon(
             # custom_icon_paths = [os.path.expanduser("~/.config/qtile/icons")],
             foreground = colors[1],
             padding = 0,
             scale = 0.7
-        ),
-        widget.CurrentLayout(
+        )),
+        spec(lambda: widget.CurrentLayout(
             foreground = colors[1],
             padding = 5
-        ),
-        widget.TextBox(
+        )),
+        spec(lambda: widget.TextBox(
             text = '|',
             font = "Ubuntu Mono",
             foreground = colors[1],
             padding = 2,
             fontsize = 14
-        ),
-        widget.WindowName(
+        )),
+        spec(lambda: widget.WindowName(
             foreground = colors[6],
             max_chars = 40
-        ),
-        widget.Spacer(),
-        widget.GenPollText(
-            func=custom_date, update_interval=1,
+        )),
+        spec(lambda: widget.Spacer()),
+        # Wakes up once a minute, when the text actually changes
+        spec(lambda: statusbar.AlignedPollText(
+            func=custom_date, time_format=CUSTOM_DATE_FORMAT,
             **widget_defaults,
             mouse_callbacks={
                 'Button1': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/calendar.sh show"), shell=True),
                 'Button3': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/calendar.sh edit"), shell=True)
                 }
-        ),
-        widget.Spacer(),
-        widget.GenPollText(
-            update_interval = 300,
-            func = lambda: subprocess.check_output("printf $(uname -r)", shell=True, text=True),
+        )),
+        spec(lambda: widget.Spacer()),
+        spec(lambda: statusbar.OnceText(
+            func = statusbar.kernel_release,
             foreground = colors[3],
             fmt = '❤  {}',
-            decorations=[
-                BorderDecoration(
-                    colour = colors[3],
-                    border_width = [0, 0, 2, 0],
-                )
-            ],
-        ),
-        widget.Spacer(length = 8),
-        widget.CPU(
+            decorations=underline(colors[3]),
+        )),
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: statusbar.shared(widget.CPU)(
             format = '▓  Cpu: {load_percent}%',
             foreground = colors[4],
-            decorations=[
-                BorderDecoration(
-                    colour = colors[4],
-                    border_width = [0, 0, 2, 0],
-                )
-            ],
-        ),
-        widget.Spacer(length = 8),
-        widget.Memory(
+            decorations=underline(colors[4]),
+        )),
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: statusbar.shared(widget.Memory)(
             foreground = colors[8],
             mouse_callbacks = {'Button1': lambda: qtile.cmd_spawn(myTerm + ' -e htop')},
             format = '{MemUsed: .0f}{mm}',
             fmt = '🖥  Mem: {} used',
-            decorations=[
-                BorderDecoration(
-                    colour = colors[8],
-                    border_width = [0, 0, 2, 0],
-                )
-            ],
-        ),
-        widget.Spacer(length = 8),
-        widget.DF(
+            decorations=underline(colors[8]),
+        )),
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: widget.DF(
             update_interval = 60,
             foreground = colors[5],
             mouse_callbacks = {'Button1': lambda: qtile.cmd_spawn(myTerm + ' -e df')},
@@ -592,89 +684,82 @@ def init_widgets_list():
             format = '{uf}{m} free',
             fmt = '🖴  Disk: {}',
             visible_on_warn = False,
-            decorations=[
-                BorderDecoration(
-                    colour = colors[5],
-                    border_width = [0, 0, 2, 0],
-                )
-            ],
-        ),
-        widget.Spacer(length = 8),
-        widget.Volume(
+            decorations=underline(colors[5]),
+        )),
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: widget.Volume(
             foreground = colors[7],
             fmt = '🕫  Vol: {}',
-            decorations=[
-                BorderDecoration(
-                    colour = colors[7],
-                    border_width = [0, 0, 2, 0],
-                )
-            ],
-        ),
-        widget.Spacer(length = 8),
-        widget.KeyboardLayout(
+            decorations=underline(colors[7]),
+        )),
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: widget.KeyboardLayout(
                  foreground = colors[4],
                  fmt = '⌨  Kbd: {}',
-                 decorations=[
-                     BorderDecoration(
-                         colour = colors[4],
-                         border_width = [0, 0, 2, 0],
-                     )
-                 ],
-                 ),
-        widget.Spacer(length = 8),
-        widget.Clock(
+                 decorations=underline(colors[4]),
+                 )),
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: widget.Clock(
             foreground = colors[8],
             format = "⏱  %a, %b %d - %H:%M",
-            decorations=[
-                BorderDecoration(
-                    colour = colors[8],
-                    border_width = [0, 0, 2, 0],
-                )
-            ],
-        ),
-        widget.Spacer(length = 8),
-        widget.ThermalSensor(
+            update_interval = 60,
+            decorations=underline(colors[8]),
+        )),
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: statusbar.shared(widget.ThermalSensor, 'get_temp_sensors')(
                 foreground = colors[5],
                 foreground_alert = colors[6],
                 metric = True,
                 padding = 3,
                 threshold = 80,
-                decorations=[
-                BorderDecoration(
-                    colour = colors[3],
-                    border_width = [0, 0, 2, 0],
-                )
-            ],
-        ),
-        widget.Spacer(length = 8),
-        arcobattery.BatteryIcon(
+                decorations=underline(colors[3]),
+        )),
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: arcobattery.BatteryIcon(
                 padding=0,
                 scale=0.7,
                 y_poss=2,
                 theme_path=home + "/.config/qtile/icons/battery_icons_horiz",
-                update_interval = 5,
-        ),
-        widget.Spacer(length = 8),
-        widget.Systray(padding = 3),
-        widget.GenPollText(
-            update_interval=1,
+                min_update_delay = 5,
+        )),
+        spec(lambda: widget.Spacer(length = 8), 'tray'),
+        spec(lambda: widget.Systray(padding = 3), 'tray'),
+        spec(lambda: statusbar.shared(statusbar.Backlight)(
             **widget_defaults,
-            func=lambda: subprocess.check_output(os.path.expanduser("~/.local/bin/statusbar/brightnesscontrol")).decode(),
             mouse_callbacks={
                 'Button1': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/brightnesscontrol down"), shell=True),
                 'Button3': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/brightnesscontrol up"), shell=True)
                 }
-        ),
-        widget.Spacer(length=5),
-        widget.GenPollText(update_interval=1, **widget_defaults, func=lambda: subprocess.check_output(os.path.expanduser("~/.local/bin/statusbar/volumecontrol")).decode(), mouse_callbacks={'Button1': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/volumecontrol down"), shell=True), 'Button2': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/volumecontrol mute"), shell=True), 'Button3': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/volumecontrol up"), shell=True)}),
-        widget.Spacer(length=5),
-        widget.GenPollText(update_interval=1, **widget_defaults, func=lambda: subprocess.check_output(os.path.expanduser("~/.local/bin/statusbar/battery.py")).decode(), mouse_callbacks={'Button1': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/battery.py --c left-click"), shell=True)}),
-        widget.Spacer(length=5),
-        widget.GenPollText(update_interval=1, **widget_defaults, func=lambda: subprocess.check_output(os.path.expanduser("~/.local/bin/statusbar/network.sh")).decode(), mouse_callbacks={'Button1': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/network.sh ShowInfo"), shell=True), 'Button3': lambda: qtile.cmd_spawn(terminal + ' -e nmtui', shell=True)}),
-        widget.Spacer(length=10),
-
-        widget.Spacer(length = 8),
-        widget.TextBox(
+        )),
+        spec(lambda: widget.Spacer(length=5), *volume_tags),
+        spec(lambda: volume_widget(
+            **widget_defaults,
+            mouse_callbacks={
+                'Button1': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/volumecontrol down"), shell=True),
+                'Button2': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/volumecontrol mute"), shell=True),
+                'Button3': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/volumecontrol up"), shell=True)
+                }
+        ), *volume_tags),
+        spec(lambda: widget.Spacer(length=5)),
+        # Shares its samples with the BatteryIcon above instead of running
+        # battery.py every second
+        spec(lambda: arcobattery.Battery(
+            **widget_defaults,
+            format = '{char} {percent:2.0%}',
+            mouse_callbacks={'Button1': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/battery.py --c left-click"), shell=True)}
+        )),
+        spec(lambda: widget.Spacer(length=5)),
+        spec(lambda: statusbar.shared(statusbar.Network)(
+            **widget_defaults,
+            mouse_callbacks={
+                'Button1': lambda: qtile.cmd_spawn(os.path.expanduser("~/.local/bin/statusbar/network.sh ShowInfo"), shell=True),
+                'Button3': lambda: qtile.cmd_spawn(myTerm + ' -e nmtui', shell=True)
+                }
+        )),
+        spec(lambda: widget.Spacer(length=10)),
+
+        spec(lambda: widget.Spacer(length = 8)),
+        spec(lambda: widget.TextBox(
             text='',
             mouse_callbacks= {
                 'Button1':
@@ -682,37 +767,27 @@ def init_widgets_list():
             },
             padding = 10,
             foreground='#e39378'
-        ),
+        )),
 
         ]
-    return widgets_list
-
-# Monitor 1 will display ALL widgets in widgets_list. It is important that this
-# is the only monitor that displays all widgets because the systray widget will
-# crash if you try to run multiple instances of it.
-def init_widgets_screen1():
-    widgets_screen1 = init_widgets_list()
-    return widgets_screen1 
 
-# All other monitors' bars will display everything but widgets 22 (systray) and 23 (spacer).
-def init_widgets_screen2():
-    widgets_screen2 = init_widgets_list()
-    del widgets_screen2[22:24]
-    return widgets_screen2
+def init_widgets_screen(index):
+    profile = screen_profiles[screen_layout[index]]
+    return build_widgets(widget_specs, index, profile)
 
 # For adding transparency to your bar, add (background="#00000000") to the "Screen" line(s)
-# For ex: Screen(top=bar.Bar(widgets=init_widgets_screen2(), background="#00000000", size=24)),
+# For ex: Screen(top=bar.Bar(widgets=init_widgets_screen(1), background="#00000000", size=24)),
 
+def init_screen(index):
+    return Screen(top=bar.Bar(widgets=init_widgets_screen(index), size=26))
+
+# qtile looks up one screen per connected monitor, only those bars are
+# built, when qtile asks for them
 def init_screens():
-    return [Screen(top=bar.Bar(widgets=init_widgets_screen1(), size=26)),
-            Screen(top=bar.Bar(widgets=init_widgets_screen2(), size=26)),
-            Screen(top=bar.Bar(widgets=init_widgets_screen2(), size=26))]
+    return LazyScreens(init_screen, len(screen_layout))
 
 if __name__ in ["config", "__main__"]:
     screens = init_screens()
-    widgets_list = init_widgets_list()
-    widgets_screen1 = init_widgets_screen1()
-    widgets_screen2 = init_widgets_screen2()
 
 # Drag floating layouts.
 mouse = [
@@ -726,10 +801,12 @@ dgroups_app_rules = []  # type: list
 follow_mouse_focus = True
 bring_front_click = False
 cursor_warp = False
-floating_layout = layout.Floating(
-    border_focus=colors[8],
-    border_width=2,
-    float_rules=[
+# Window types that always float, next to transient windows
+floating_types = ["notification", "toolbar", "splash", "dialog"]
+
+# All float rules are compiled into one check, see clients.FloatRules
+float_rules = clients.FloatRules(
+    [
         # Run the utility of `xprop` to see the wm class and name of an X client.
         *layout.Floating.default_float_rules,
         Match(wm_class="confirmreset"),   # gitk
@@ -744,7 +821,13 @@ floating_layout = layout.Floating(
         Match(wm_class='Barrier'),
         Match(wm_class='pinentry-gtk-2'), # GPG key password entry
         Match(title="pinentry"),          # GPG key password entry
-    ]
+    ],
+    floating_types=floating_types,
+)
+floating_layout = layout.Floating(
+    border_focus=colors[8],
+    border_width=2,
+    float_rules=[Match(func=float_rules)]
 )
 auto_fullscreen = True
 focus_on_window_activation = "smart"
@@ -767,13 +850,6 @@ def start_always():
     # Set the cursor to something sane in X
     subprocess.Popen(['xsetroot', '-cursor_name', 'left_ptr'])
 
-@hook.subscribe.client_new
-def set_floating(window):
-    if (window.window.get_wm_transient_for()
-            or window.window.get_wm_type() in floating_types):
-        window.floating = True
-
-
 # XXX: Gasp! We're lying here. In fact, nobody really uses or cares about this
 # string besides java UI toolkits; you can see several discussions on the
 # mailing lists, GitHub issues, and other WM documentation that suggest setting
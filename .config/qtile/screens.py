@@ -0,0 +1,92 @@
+"""Building the bars in config.py from one declarative widget list."""
+
+import time
+from collections import namedtuple
+from collections.abc import Sequence
+from libqtile.log_utils import logger
+
+# factory builds a fresh widget; tags name what the widget needs from a
+# screen, e.g. 'tray' for the systray, which can only exist once
+WidgetSpec = namedtuple('WidgetSpec', 'factory tags')
+
+
+def spec(factory, *tags):
+    return WidgetSpec(factory, frozenset(tags))
+
+
+# Profile of the screen build_widgets is building, see wants()
+_building = None
+
+
+def wants(tag):
+    """Whether the screen being built accepts tag, for factories that
+    change a widget per screen rather than leave it out"""
+    return _building is None or tag in _building
+
+
+def build_widgets(specs, index, profile=None):
+    """Instantiate the widgets of screen `index` and log how long it took.
+
+    `profile` is the set of tags the screen accepts. A widget is built
+    when all of its tags are in the profile, untagged widgets always are;
+    the others are never constructed for this screen. None accepts every
+    tag. While the factories run, wants() answers from `profile`.
+    """
+    global _building
+    widgets = []
+    timings = []
+    start = time.perf_counter()
+    skipped = 0
+    _building = profile
+    try:
+        for entry in specs:
+            if profile is not None and not entry.tags <= profile:
+                skipped += 1
+                continue
+            created = time.perf_counter()
+            widget = entry.factory()
+            timings.append((time.perf_counter() - created, widget.name))
+            widgets.append(widget)
+    finally:
+        _building = None
+    elapsed = time.perf_counter() - start
+    slowest = ', '.join(
+        '%s %.1f ms' % (name, took * 1000)
+        for took, name in sorted(timings, reverse=True)[:3]
+    )
+    logger.info(
+        "screen %d: %d widgets (%d skipped) in %.1f ms (slowest: %s)"
+        % (index, len(widgets), skipped, elapsed * 1000, slowest)
+    )
+    return widgets
+
+
+class LazyScreens(Sequence):
+    """The screens list of config.py, building each Screen on first use.
+
+    qtile only looks up as many entries as there are outputs, so the bars
+    of monitors that are not plugged in are never built; an undocked
+    laptop builds one bar. A screen built once is kept, like the Screens
+    of a plain list. `factory(index)` builds the Screen of index, `count`
+    caps how many screens there can be.
+    """
+
+    def __init__(self, factory, count):
+        self.factory = factory
+        self.count = count
+        self.built = {}
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("screen index out of range")
+        screen = self.built.get(index)
+        if screen is None:
+            screen = self.built[index] = self.factory(index)
+        return screen
@@ -0,0 +1,39 @@
+#!/bin/bash
+# Map a batch of windows and report how long qtile takes to show them.
+# Usage: bench-window-map.sh [count] [terminal]
+# Needs xdotool and timeout; the terminal must accept -class (xterm, urxvt, ...).
+
+count=${1:-100}
+term=${2:-xterm}
+class="bench-map-$$"
+wait=${WAIT:-10}  # seconds a window may take to map before giving up
+
+if ! command -v xdotool > /dev/null; then
+	echo "xdotool is required" >&2
+	exit 1
+fi
+
+total=0
+worst=0
+start_all=$(date +%s%N)
+for i in $(seq 1 "$count"); do
+	start=$(date +%s%N)
+	$term -class "$class-$i" -e sleep 600 &
+	# -class sets res_class, which --class matches (--classname is res_name)
+	if ! timeout "$wait" xdotool search --sync --onlyvisible --class "$class-$i" > /dev/null; then
+		echo "window $i did not map within ${wait}s, aborting" >&2
+		pkill -f -- "-class $class-" 2> /dev/null
+		exit 1
+	fi
+	took=$(( ($(date +%s%N) - start) / 1000 ))
+	total=$(( total + took ))
+	[ "$took" -gt "$worst" ] && worst=$took
+done
+end_all=$(date +%s%N)
+
+pkill -f -- "-class $class-" 2> /dev/null
+
+echo "windows:   $count"
+echo "wall time: $(( (end_all - start_all) / 1000000 )) ms"
+echo "mean map:  $(( total / count / 1000 )) ms"
+echo "worst map: $(( worst / 1000 )) ms"
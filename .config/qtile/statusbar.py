@@ -0,0 +1,460 @@
+"""Status widgets that keep the qtile event loop free.
+
+Backlight, Volume and Network replace polling the ~/.local/bin/statusbar
+scripts, which forked a process per widget and bar every second; they read
+the same state straight from sysfs or the sound server. The scripts stay
+in use for mouse clicks. AsyncPollText is for the commands that remain.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from libqtile import bar
+from libqtile.log_utils import logger
+from libqtile.widget import base
+
+from arcobattery import SysfsReader
+
+BACKLIGHT_DIR = '/sys/class/backlight'
+NET_DIR = '/sys/class/net'
+
+# Fraction of update_interval during which a sample is reused by the
+# mirrored widgets on other screens
+SHARE_WINDOW = 0.9
+
+# Latest (timestamp, result) per shared widget, see shared()
+_shared_samples = {}
+_shared_classes = {}
+# In-flight AsyncPollText runs per command
+_shared_runs = {}
+# Results of OnceText functions
+_once_values = {}
+
+try:
+    import pulsectl
+except ImportError:
+    pulsectl = None
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+
+class Backlight(base.InLoopPollText):
+    """Screen brightness from /sys/class/backlight"""
+
+    defaults = [
+        ('device', None, 'Name in /sys/class/backlight, None for the first'),
+        ('format', '☀ {percent:2.0%}', 'Display format'),
+        ('update_interval', 1, 'The delay in seconds between updates'),
+    ]
+
+    def __init__(self, **config):
+        base.InLoopPollText.__init__(self, **config)
+        self.add_defaults(Backlight.defaults)
+        device = self.device
+        if device is None:
+            try:
+                device = sorted(os.listdir(BACKLIGHT_DIR))[0]
+            except (OSError, IndexError):
+                device = ''
+        self._reader = SysfsReader(os.path.join(BACKLIGHT_DIR, device))
+
+    def finalize(self):
+        self._reader.close()
+        base.InLoopPollText.finalize(self)
+
+    def poll(self):
+        try:
+            now = float(self._reader.read('brightness'))
+            full = float(self._reader.read('max_brightness'))
+        except (IOError, ValueError):
+            return ''
+        return self.format.format(percent=now / full if full else 0)
+
+
+class Volume(base.ThreadPoolText):
+    """Volume of the default output through PulseAudio or ALSA.
+
+    Needs either pulsectl or pyalsaaudio, see volume_backend(). The sound
+    server is queried from qtile's thread pool, so a hung PulseAudio only
+    makes the text stale instead of stalling the event loop. The
+    connection or mixer is kept open between polls.
+    """
+
+    defaults = [
+        ('mixer', 'Master', 'ALSA mixer control to read'),
+        ('format', '🕫 {volume:d}%', 'Display format'),
+        ('mute_format', '🔇 {volume:d}%', 'Display format while muted'),
+        ('update_interval', 1, 'The delay in seconds between updates'),
+    ]
+
+    def __init__(self, **config):
+        base.ThreadPoolText.__init__(self, '', **config)
+        self.add_defaults(Volume.defaults)
+        self._pulse = None
+        self._mixer = None
+        self._failing = False
+
+    def _close(self):
+        if self._pulse is not None:
+            self._pulse.close()
+            self._pulse = None
+        if self._mixer is not None:
+            self._mixer.close()
+            self._mixer = None
+
+    def finalize(self):
+        self._close()
+        base.ThreadPoolText.finalize(self)
+
+    def _get_state(self):
+        if pulsectl is not None:
+            if self._pulse is None:
+                self._pulse = pulsectl.Pulse('qtile-volume')
+            name = self._pulse.server_info().default_sink_name
+            sink = self._pulse.get_sink_by_name(name)
+            return round(sink.volume.value_flat * 100), bool(sink.mute)
+        if self._mixer is None:
+            self._mixer = alsaaudio.Mixer(self.mixer)
+        else:
+            # An open mixer caches its values until told to reload them
+            self._mixer.handleevents()
+        try:
+            mute = any(self._mixer.getmute())
+        except alsaaudio.ALSAAudioError:
+            # Controls without a playback switch can't be muted
+            mute = False
+        return self._mixer.getvolume()[0], mute
+
+    def poll(self):
+        try:
+            volume, mute = self._get_state()
+        except Exception:
+            # Reconnect on the next poll, and only log the first failure
+            # of a streak instead of one traceback per second
+            self._close()
+            if not self._failing:
+                logger.exception("Failed to read the volume")
+            self._failing = True
+            return ''
+        self._failing = False
+        if mute:
+            return self.mute_format.format(volume=volume)
+        return self.format.format(volume=volume)
+
+
+def volume_backend():
+    """Name of the library Volume reads from, or None if none is installed"""
+    if pulsectl is not None:
+        return 'pulsectl'
+    if alsaaudio is not None:
+        return 'alsaaudio'
+    return None
+
+
+class Network(base.InLoopPollText):
+    """Connection state of the first interface that is up"""
+
+    defaults = [
+        ('interface', None, 'Interface in /sys/class/net, None for any'),
+        ('format', '{icon} {interface}', 'Display format'),
+        ('wireless_format',
+         '{icon} {interface} {quality}%',
+         'Display format for wireless interfaces'
+         ),
+        ('disconnected', '睊 offline', 'Text while no interface is up'),
+        ('wired_icon', '', 'Icon for wired interfaces'),
+        ('wireless_icon', '直', 'Icon for wireless interfaces'),
+        ('update_interval', 1, 'The delay in seconds between updates'),
+    ]
+
+    def __init__(self, **config):
+        base.InLoopPollText.__init__(self, **config)
+        self.add_defaults(Network.defaults)
+        self._readers = {}
+
+    def finalize(self):
+        for reader in self._readers.values():
+            reader.close()
+        base.InLoopPollText.finalize(self)
+
+    def _interfaces(self):
+        if self.interface:
+            return [self.interface]
+        try:
+            names = sorted(os.listdir(NET_DIR))
+        except OSError:
+            return []
+        return [name for name in names if name != 'lo']
+
+    def _is_up(self, name):
+        reader = self._readers.get(name)
+        if reader is None:
+            reader = self._readers[name] = SysfsReader(
+                os.path.join(NET_DIR, name)
+            )
+        try:
+            return reader.read('operstate') == 'up'
+        except IOError:
+            # The interface is gone, forget its descriptors
+            self._readers.pop(name).close()
+            return False
+
+    def _quality(self, name):
+        # /proc/net/wireless has two header lines, then one line per
+        # interface: "wlan0: 0000   54.  -56.  -256 ..."
+        try:
+            with open('/proc/net/wireless', 'r') as f:
+                lines = f.readlines()[2:]
+        except IOError:
+            return 0
+        for line in lines:
+            iface, _, fields = line.partition(':')
+            if iface.strip() == name:
+                try:
+                    return int(float(fields.split()[1]) * 100 / 70)
+                except (IndexError, ValueError):
+                    return 0
+        return 0
+
+    def poll(self):
+        for name in self._interfaces():
+            if not self._is_up(name):
+                continue
+            if os.path.isdir(os.path.join(NET_DIR, name, 'wireless')):
+                return self.wireless_format.format(
+                    icon=self.wireless_icon,
+                    interface=name,
+                    quality=self._quality(name),
+                )
+            return self.format.format(icon=self.wired_icon, interface=name)
+        return self.disconnected
+
+
+def _share_key(widget, *extra):
+    """Identify widgets built from the same entry of widget_specs"""
+    config = tuple(sorted(
+        (name, value) for name, value in widget._user_config.items()
+        if isinstance(value, (str, int, float, bool, tuple))
+    ))
+    return (type(widget).__name__, config) + extra
+
+
+def _fresh(entry, interval):
+    # Timers of mirrored widgets fire close together, anything sampled
+    # within most of an interval counts as this interval's sample
+    return entry is not None and \
+        time.monotonic() - entry[0] < interval * SHARE_WINDOW
+
+
+def shared(cls, method='poll'):
+    """Subclass of a polling widget that samples once for all screens.
+
+    screens.build_widgets builds an instance per screen from each entry of
+    widget_specs in config.py; with shared(widget.CPU) instead of
+    widget.CPU, the first instance to poll in an interval calls `method`
+    and the mirrored instances on the other screens render from its
+    cached result.
+
+    Only wrap widgets whose `method` just returns a value: the mirrored
+    instances skip everything else it does. CPU, Memory and the widgets of
+    this module are safe with poll. ThermalSensor needs 'get_temp_sensors',
+    since its poll also sets the alert colour. DF has no such lower level
+    method, its poll sets the warn colour, so it is not shared.
+    """
+    subclass = _shared_classes.get((cls, method))
+    if subclass is not None:
+        return subclass
+
+    sample = getattr(cls, method)
+
+    def cached(self, *args):
+        key = _share_key(self, method, args)
+        entry = _shared_samples.get(key)
+        if not _fresh(entry, self.update_interval):
+            entry = (time.monotonic(), sample(self, *args))
+            _shared_samples[key] = entry
+        return entry[1]
+
+    # Keep the class name, qtile derives the widget name from it
+    subclass = type(cls.__name__, (cls,), {method: cached})
+    _shared_classes[(cls, method)] = subclass
+    return subclass
+
+
+# strftime fields by the number of seconds after which they change
+_TIME_FIELDS = (
+    (1, 'ScTXrsf'),
+    (60, 'MR'),
+    (3600, 'HIklp'),
+)
+
+
+def time_period(time_format):
+    """Seconds between changes of a strftime format's finest field"""
+    fields = set(
+        time_format[i + 1] for i in range(len(time_format) - 1)
+        if time_format[i] == '%'
+    )
+    for period, chars in _TIME_FIELDS:
+        if fields.intersection(chars):
+            return period
+    return 86400
+
+
+class AlignedPollText(base.InLoopPollText):
+    """Polls func exactly when the time shown by time_format changes.
+
+    Instead of waking every update_interval seconds, the next poll is
+    scheduled at the next wall clock boundary of the finest field in
+    time_format: the next minute for '%H:%M', the next midnight for a
+    plain date.
+    """
+
+    defaults = [
+        ('func', None, 'Function returning the text'),
+        ('time_format', '%H:%M', 'strftime format func renders'),
+    ]
+
+    def __init__(self, **config):
+        base.InLoopPollText.__init__(self, **config)
+        self.add_defaults(AlignedPollText.defaults)
+        self.period = time_period(self.time_format)
+
+    def poll(self):
+        return self.func()
+
+    def _delay(self):
+        now = datetime.now()
+        elapsed = (now.hour * 60 + now.minute) * 60 + now.second + \
+            now.microsecond / 1e6
+        # Land just after the boundary so the new value is there
+        return self.period - elapsed % self.period + 0.01
+
+    def timer_setup(self):
+        self.update(self.poll())
+        self.timeout_add(self._delay(), self.timer_setup)
+
+
+def kernel_release():
+    return os.uname().release
+
+
+class OnceText(base._TextBox):
+    """Text from a function that is called once per qtile process.
+
+    For values that can't change while qtile runs, such as the kernel
+    version: no timer is set up, and every screen shows the same result.
+    """
+
+    defaults = [
+        ('func', None, 'Function returning the text'),
+    ]
+
+    def __init__(self, **config):
+        func = config.get('func')
+        if func not in _once_values:
+            _once_values[func] = func() if func is not None else ''
+        base._TextBox.__init__(
+            self, _once_values[func], bar.CALCULATED, **config
+        )
+        self.add_defaults(OnceText.defaults)
+
+
+class AsyncPollText(base._TextBox):
+    """Text from a command, run without blocking the event loop.
+
+    The command runs as an asyncio subprocess and is killed after
+    `timeout` seconds. A run is never started while the previous one is
+    still going, and the last good output stays up until a new one
+    arrives, so a slow or hung script only makes the text stale. Instances
+    with the same command, e.g. the copies on every screen, share runs and
+    their output.
+    """
+
+    defaults = [
+        ('cmd', None, 'Command to run, a list of arguments or a string'),
+        ('shell', False, 'Run cmd through the shell'),
+        ('update_interval', 1, 'The delay in seconds between runs'),
+        ('timeout', 5, 'Seconds before a run is killed'),
+        ('parse', None, 'Function turning the output into the text'),
+    ]
+
+    def __init__(self, **config):
+        base._TextBox.__init__(self, '', bar.CALCULATED, **config)
+        self.add_defaults(AsyncPollText.defaults)
+        cmd = self.cmd if isinstance(self.cmd, str) else tuple(self.cmd)
+        self._key = ('AsyncPollText', cmd, self.shell)
+        self._task = None
+
+    def timer_setup(self):
+        entry = _shared_samples.get(self._key)
+        if _fresh(entry, self.update_interval):
+            self._set_output(entry[1])
+        elif self._task is None or self._task.done():
+            task = _shared_runs.get(self._key)
+            if task is None or task.done():
+                task = asyncio.ensure_future(self._run())
+                _shared_runs[self._key] = task
+            self._task = task
+            task.add_done_callback(self._on_done)
+        self.timeout_add(self.update_interval, self.timer_setup)
+
+    def finalize(self):
+        # Leave a shared run alone, other screens may still wait for it
+        self._task = None
+        base._TextBox.finalize(self)
+
+    def _on_done(self, task):
+        if task is not self._task or task.cancelled():
+            return
+        if task.exception() is not None:
+            # Raising here would only get logged by asyncio, every tick
+            return
+        output = task.result()
+        if output is not None:
+            self._set_output(output)
+
+    def _set_output(self, output):
+        text = output
+        if self.parse is not None:
+            text = self.parse(text)
+        if text != self.text:
+            self.text = text
+            self.bar.draw()
+
+    async def _run(self):
+        try:
+            if self.shell:
+                proc = await asyncio.create_subprocess_shell(
+                    self.cmd, stdout=asyncio.subprocess.PIPE
+                )
+            else:
+                proc = await asyncio.create_subprocess_exec(
+                    *self.cmd, stdout=asyncio.subprocess.PIPE
+                )
+        except OSError as e:
+            # Missing or not executable
+            logger.warning("Failed to run %s: %s" % (self.cmd, e))
+            return None
+        try:
+            output, _ = await asyncio.wait_for(
+                proc.communicate(), self.timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("%s timed out after %ss" % (self.cmd, self.timeout))
+            proc.kill()
+            await proc.wait()
+            return None
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+        if proc.returncode != 0:
+            logger.warning("%s exited with %d" % (self.cmd, proc.returncode))
+            return None
+        output = output.decode(errors='replace').strip()
+        _shared_samples[self._key] = (time.monotonic(), output)
+        return output
@@ -0,0 +1,233 @@
+"""Swapping the colorscheme of a running qtile without lazy.restart."""
+
+import os
+import time
+from libqtile import bar
+from libqtile.log_utils import logger
+from libqtile.widget import base
+
+import arcobattery
+import colors
+
+# lazy.restart re-executes qtile in the same process, only the environment
+# survives it; Theme.restarting leaves the time the restart began here
+RESTART_ENV = 'QTILE_THEME_RESTART'
+
+
+def schemes():
+    """The colors.Palette objects, in the order colors.py defines them"""
+    return [
+        value for value in vars(colors).values()
+        if isinstance(value, colors.Palette)
+    ]
+
+
+# Palette attributes holding one hex string per colour
+SHADES = ('hex', 'dim', 'bright', 'translucent')
+
+
+class ThemeColour(str):
+    """A colour handed out by a Theme, which remembers the palette entry
+    it came from. swap() only recolours values of this type, so colours
+    that merely look the same, like a widget's own default, are kept."""
+
+    __slots__ = ('shade', 'index')
+
+    def __new__(cls, value, shade, index):
+        colour = str.__new__(cls, value)
+        colour.shade = shade
+        colour.index = index
+        return colour
+
+    @classmethod
+    def of(cls, palette, shade, index):
+        return cls(getattr(palette, shade)[index], shade, index)
+
+    def __getnewargs__(self):
+        # qtile copies and deep-copies config values
+        return (str(self), self.shade, self.index)
+
+    def swapped(self, palette):
+        return ThemeColour.of(palette, self.shade, self.index)
+
+
+def _swapped(value, palette):
+    """value with its ThemeColours taken from palette, or None if it has
+    none; handles single colours and lists of them"""
+    if isinstance(value, ThemeColour):
+        return value.swapped(palette)
+    if isinstance(value, list) and \
+            any(isinstance(v, ThemeColour) for v in value):
+        return [
+            v.swapped(palette) if isinstance(v, ThemeColour) else v
+            for v in value
+        ]
+    return None
+
+
+def _recolour(obj, palette):
+    """Swap the ThemeColours among the attributes of obj, or the values
+    of a dict. Returns how many changed."""
+    items = obj.items() if isinstance(obj, dict) else \
+        getattr(obj, '__dict__', {}).items()
+    changed = []
+    for name, value in items:
+        new = _swapped(value, palette)
+        if new is not None:
+            changed.append((name, new))
+    for name, new in changed:
+        if isinstance(obj, dict):
+            obj[name] = new
+        else:
+            setattr(obj, name, new)
+    return len(changed)
+
+
+def _refresh(widget, palette):
+    """Recolour the text of widget, then let it re-derive its state colour
+    (low battery, warn, alert) the way it does on an update"""
+    layout = getattr(widget, 'layout', None)
+    colour = _swapped(getattr(layout, 'colour', None), palette)
+    if colour is not None:
+        layout.colour = colour
+    try:
+        if isinstance(widget, base.InLoopPollText):
+            widget.update(widget.poll())
+        elif isinstance(widget, (arcobattery.Battery,
+                                 arcobattery.BatteryIcon)):
+            widget.update()
+    except Exception:
+        logger.exception("Failed to update %s after a colorscheme swap"
+                         % widget.name)
+
+
+class Theme(object):
+    """The active colorscheme of config.py, swappable while qtile runs.
+
+    It indexes like the palette it wraps, so config.py builds its widgets
+    and layouts from it as before, but every colour it hands out is a
+    ThemeColour. swap() then changes the colours of the running widgets,
+    bars, decorations and layouts in place: each attribute holding a
+    ThemeColour gets the same entry of the new palette, and the widgets
+    update once to re-derive their state colours. Each bar is redrawn
+    once afterwards.
+
+    Bars, widgets and PNG atlases all stay as they are, which is what makes
+    this cheaper than lazy.restart; swap_latency and restart_latency hold
+    the last measured time of each, in seconds.
+    """
+
+    def __init__(self, palette):
+        self.palette = palette
+        self.tracked = []
+        self.swap_latency = None
+        self.restart_latency = None
+
+    def __getitem__(self, index):
+        return ThemeColour.of(self.palette, 'hex', index)
+
+    def __len__(self):
+        return len(self.palette)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __getattr__(self, name):
+        # dim, bright, translucent, rgba and name of the active palette
+        if name == 'palette':
+            raise AttributeError(name)
+        if name in SHADES:
+            return tuple(
+                ThemeColour.of(self.palette, name, i)
+                for i in range(len(self))
+            )
+        return getattr(self.palette, name)
+
+    def track(self, *configs):
+        """Also recolour these dicts, e.g. widget_defaults, so widgets
+        built after a swap get the new colours"""
+        self.tracked.extend(configs)
+
+    def restarting(self):
+        os.environ[RESTART_ENV] = repr(time.time())
+
+    def started(self):
+        began = os.environ.pop(RESTART_ENV, None)
+        if began is None:
+            return
+        self.restart_latency = time.time() - float(began)
+        logger.info("restart took %.1f ms" % (self.restart_latency * 1000))
+
+    def _bars(self, screens):
+        for screen in screens:
+            for gap in (screen.top, screen.bottom, screen.left, screen.right):
+                if isinstance(gap, bar.Bar):
+                    yield gap
+
+    def swap(self, qtile, name):
+        """Make the palette colors.<name> the active one"""
+        new = getattr(colors, name)
+        if not isinstance(new, colors.Palette):
+            raise ValueError("%s is not a colorscheme" % name)
+        start = time.perf_counter()
+        self.palette = new
+
+        changed = sum(_recolour(config, new) for config in self.tracked)
+        shown = list(self._bars(qtile.screens))
+        # Screens of unplugged monitors kept by screens.LazyScreens, so
+        # their bars have the new colours when the monitor comes back
+        kept = getattr(qtile.config.screens, 'built', {}).values()
+        bars = dict((id(b), b) for b in shown + list(self._bars(kept)))
+        for status_bar in bars.values():
+            changed += _recolour(status_bar, new)
+            for widget in status_bar.widgets:
+                changed += _recolour(widget, new)
+                for decoration in getattr(widget, 'decorations', ()):
+                    changed += _recolour(decoration, new)
+        for status_bar in shown:
+            for widget in status_bar.widgets:
+                _refresh(widget, new)
+        for group in qtile.groups:
+            for layout in group.layouts + [group.floating_layout]:
+                changed += _recolour(layout, new)
+
+        # Window borders are painted when a layout places its windows
+        for screen in qtile.screens:
+            if screen.group is not None:
+                screen.group.layout_all()
+        for status_bar in shown:
+            if status_bar.widgets:
+                status_bar.draw()
+
+        def report():
+            self.swap_latency = time.perf_counter() - start
+            restart = ''
+            if self.restart_latency is not None:
+                restart = ", restart took %.1f ms" % (
+                    self.restart_latency * 1000
+                )
+            logger.info(
+                "colorscheme %s: %d colours in %.1f ms%s"
+                % (name, changed, self.swap_latency * 1000, restart)
+            )
+
+        # Bars draw on the next loop iteration, report once they have
+        qtile.call_soon(report)
+
+    def cycle(self, qtile):
+        """Swap to the colorscheme after the active one in colors.py"""
+        palettes = schemes()
+        position = palettes.index(self.palette) \
+            if self.palette in palettes else -1
+        self.swap(qtile, palettes[(position + 1) % len(palettes)].name)
+
+
+if __name__ == '__main__':
+    # Sanity check: colours from a Theme survive qtile copying its config
+    import copy
+    theme = Theme(colors.DoomOne)
+    for colour in (theme[0], theme.dim[3]):
+        for clone in (copy.copy(colour), copy.deepcopy(colour)):
+            assert type(clone) is ThemeColour and clone == colour
+            assert (clone.shade, clone.index) == (colour.shade, colour.index)
+    print("ok")